@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+'''
+AnalysisThread
+
+Runs a scan or haplotype analysis off the GUI thread for the Qt dialogs.
+The job gets an Instrument.Trace whose progress is sent back as signals;
+ProgressPanel shows the stage, percent done, throughput and ETA, and its
+Cancel button asks the run to stop at the next block, keeping what is
+finished.
+'''
+
+from PyQt5 import QtCore, QtWidgets
+
+import Instrument
+
+def formatSeconds(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return '%d:%02d:%02d' % (seconds // 3600,seconds // 60 % 60,seconds % 60)
+    return '%d:%02d' % (seconds // 60,seconds % 60)
+
+class AnalysisThread(QtCore.QThread):
+    # job(trace) runs on the thread; its return value is sent with succeeded
+    progressed = QtCore.pyqtSignal(str,float,float,float,str)#stage, fraction, rate, eta, unit; -1 when unknown
+    succeeded = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(object)
+
+    def __init__(self,job,parent=None):
+        super(AnalysisThread, self).__init__(parent)
+        self.job = job
+        self.trace = Instrument.Trace(listener=self.report)
+
+    def report(self,stage,fraction,rate,eta,unit):
+        unknown = lambda x: -1. if x is None else float(x)
+        self.progressed.emit(stage,unknown(fraction),unknown(rate),unknown(eta),unit or '')
+
+    def run(self):
+        try:
+            result = self.job(self.trace)
+        except Exception as e:
+            self.failed.emit(e)
+            return
+        self.succeeded.emit(result)
+
+    def cancel(self):
+        self.trace.cancel()
+
+    def cancelled(self):
+        return self.trace.cancelled
+
+class ProgressPanel(QtWidgets.QWidget):
+    # stage label, progress bar and Cancel button following an AnalysisThread
+    def __init__(self,parent=None):
+        super(ProgressPanel, self).__init__(parent)
+        self.stageLabel = QtWidgets.QLabel('')
+        self.bar = QtWidgets.QProgressBar()
+        self.bar.setRange(0,100)
+        self.cancelButton = QtWidgets.QPushButton('Cancel')
+        barLayout = QtWidgets.QHBoxLayout()
+        barLayout.addWidget(self.bar)
+        barLayout.addWidget(self.cancelButton)
+        layout = QtWidgets.QVBoxLayout()
+        layout.setContentsMargins(0,0,0,0)
+        layout.addWidget(self.stageLabel)
+        layout.addLayout(barLayout)
+        self.setLayout(layout)
+        self.thread = None
+        self.cancelButton.clicked.connect(self.cancel)
+
+    def follow(self,thread):
+        self.thread = thread
+        self.cancelButton.setEnabled(True)
+        self.cancelButton.setText('Cancel')
+        thread.progressed.connect(self.showProgress)
+        self.show()
+
+    def showProgress(self,stage,fraction,rate,eta,unit):
+        if fraction < 0:
+            self.bar.setRange(0,0)#busy indicator until the stage reports progress
+            self.stageLabel.setText(stage.capitalize() + '...')
+            return
+        self.bar.setRange(0,100)
+        self.bar.setValue(int(100*fraction))
+        text = stage.capitalize() + ': ' + str(int(100*fraction)) + '%'
+        if rate >= 0:
+            text += ', ' + ('%.0f' % rate) + ' ' + unit + '/s'
+        if eta >= 0:
+            text += ', ' + formatSeconds(eta) + ' left'
+        self.stageLabel.setText(text)
+
+    def cancel(self):
+        if self.thread is not None and self.thread.isRunning():
+            self.thread.cancel()
+            self.cancelButton.setEnabled(False)
+            self.cancelButton.setText('Stopping...')
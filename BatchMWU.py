@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+'''
+BatchMWU
+
+Two-sided Mann-Whitney U tests for many group partitions of one pooled
+sample at once. The pooled observations are sorted (ranked) once; every
+partition then only needs its per-tie-group counts, from which the U
+statistic and the tie-corrected normal approximation follow as array
+operations. p-values match scipy.stats.mannwhitneyu(x, y,
+alternative='two-sided') with the default method and continuity correction.
+'''
+
+import numpy
+from scipy import special, stats
+
+def rankObservations(values,owners):
+    # values: pooled observations; owners: index of the patient each one came from
+    values = numpy.asarray(values,dtype=float)
+    owners = numpy.asarray(owners,dtype=numpy.intp)
+    keep = ~numpy.isnan(values)
+    values = values[keep]
+    owners = owners[keep]
+    order = numpy.argsort(values,kind='mergesort')
+    values = values[order]
+    owners = owners[order]
+    starts = numpy.flatnonzero(numpy.r_[True,values[1:] != values[:-1]]) if len(values) > 0 else numpy.zeros(0,dtype=numpy.intp)
+    return values, owners, starts
+
+def groupCounts(ranked,mask):
+    # mask: partitions x owners -> partitions x tie groups observation counts
+    values, owners, starts = ranked
+    if len(values) == 0:
+        return numpy.zeros((mask.shape[0],0))
+    nGroups = len(starts)
+    if nGroups*mask.shape[1] <= 16*len(values):
+        #few tie groups (scores, pooled repeats): per-owner tallies of each tie group times the masks
+        group = numpy.repeat(numpy.arange(nGroups),numpy.diff(numpy.r_[starts,len(values)]))
+        tallies = numpy.zeros((mask.shape[1],nGroups))
+        numpy.add.at(tallies,(owners,group),1)
+        return mask.astype(numpy.float64) @ tallies
+    obsMask = mask[:,owners].view(numpy.int8)
+    return numpy.add.reduceat(obsMask,starts,axis=1,dtype=numpy.int32).astype(numpy.float64)
+
+def uStatistics(countsA,countsB):
+    nA = countsA.sum(axis=1)
+    nB = countsB.sum(axis=1)
+    belowB = numpy.cumsum(countsB,axis=1) - countsB
+    U1 = (countsA * (belowB + 0.5*countsB)).sum(axis=1)
+    tied = countsA + countsB
+    tieTerm = (tied**3 - tied).sum(axis=1)
+    hasTies = (tied > 1).any(axis=1)
+    return U1, nA, nB, tieTerm, hasTies
+
+def asymptoticP(U1,nA,nB,tieTerm):
+    n = nA + nB
+    U = numpy.maximum(U1,nA*nB - U1)
+    with numpy.errstate(divide='ignore',invalid='ignore'):
+        var = nA*nB/12 * ((n + 1) - tieTerm/(n*(n - 1)))
+        z = (U - nA*nB/2 - 0.5) / numpy.sqrt(numpy.clip(var,0,None))
+    return numpy.clip(2*special.ndtr(-z),0.,1.)
+
+def mannWhitneyRanked(ranked,maskA,maskB,chunksize=None):
+    # returns U of group A, two-sided p, and group sizes for each partition (row of maskA/maskB)
+    values = ranked[0]
+    nPart = maskA.shape[0]
+    if chunksize is None:
+        chunksize = max(1,int(2**22/max(1,len(values))))
+    U1 = numpy.zeros(nPart)
+    p = numpy.full(nPart,numpy.nan)
+    nA = numpy.zeros(nPart,dtype=numpy.int64)
+    nB = numpy.zeros(nPart,dtype=numpy.int64)
+    for start in range(0,nPart,chunksize):
+        stop = min(nPart,start+chunksize)
+        countsA = groupCounts(ranked,maskA[start:stop])
+        countsB = groupCounts(ranked,maskB[start:stop])
+        U1_, nA_, nB_, tieTerm, hasTies = uStatistics(countsA,countsB)
+        U1[start:stop] = U1_
+        nA[start:stop] = nA_
+        nB[start:stop] = nB_
+        p[start:stop] = asymptoticP(U1_,nA_,nB_,tieTerm)
+        #scipy uses the exact distribution for small, tie-free samples
+        exact = (nA_ > 0) & (nB_ > 0) & ((nA_ <= 8) | (nB_ <= 8)) & ~hasTies
+        for i in numpy.flatnonzero(exact):
+            x = values[maskA[start+i,ranked[1]]]
+            y = values[maskB[start+i,ranked[1]]]
+            p[start+i] = stats.mannwhitneyu(x,y,alternative='two-sided')[1]
+    empty = (nA == 0) | (nB == 0)
+    U1[empty] = numpy.nan
+    p[empty] = numpy.nan
+    return U1, p, nA, nB
+
+def mannWhitneyBatch(values,owners,maskA,maskB,chunksize=None):
+    return mannWhitneyRanked(rankObservations(values,owners),maskA,maskB,chunksize)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmark
+
+Stage timings of the scan, haplotype and control-check pipelines on
+SyntheticCohort workbooks of several sizes. Results can be saved as JSON
+and compared with an earlier run to catch regressions.
+
+Run "python Benchmark.py --sizes small medium --save bench.json" and later
+"python Benchmark.py --sizes small medium --baseline bench.json".
+'''
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import numpy
+
+import HaplotypeEngine
+import Instrument
+import SNPEngine
+import SNPControlCheck
+import SNPReader
+import SyntheticCohort
+
+sizes = {'tiny':(60,500,3),
+         'small':(150,5000,6),
+         'medium':(400,50000,12),
+         'large':(1000,200000,25)}
+
+def stageTimes(trace):
+    return {record['stage']:record['wall s'] for record in trace.stages}
+
+def benchScan(path,outputName,workers=1):
+    trace = Instrument.Trace(quiet=True)
+    with trace.stage('scan.read'):
+        data = SNPReader.readFile(path,'Sheet1','A1')
+    with trace.stage('scan.reduce'):
+        data, store, cyts, cytokineIndices = SNPEngine.reduceData(data)
+        patients = store.genotypedPatients()
+    with trace.stage('scan.cytokines'):
+        cytTable = SNPEngine.buildCytokineTable(data,cytokineIndices,patients)
+    with trace.stage('scan.screen'):
+        goodSNPs, patientsAA, patientsBB = SNPEngine.screenSNPs(store)
+    sink = SNPEngine.reportSink(outputName)
+    with trace.stage('scan.test'):
+        significanceCount = SNPEngine.sortCytokineForSNP(goodSNPs,cyts,patientsAA,patientsBB,cytTable,time.time(),sink,workers)
+    with trace.stage('scan.write'):
+        significanceCount = SNPEngine.writeResults(significanceCount,outputName)
+        sink.close()
+    return stageTimes(trace), (store, cyts, cytTable, significanceCount)
+
+def benchHaplotype(store,cyts,cytTable,nSNPs=200,workers=1,minCount=20):
+    trace = Instrument.Trace(quiet=True)
+    snps = [name for name in store.snpNames[:nSNPs]]
+    with trace.stage('haplotype.pairs'):
+        pairs = HaplotypeEngine.pairCooccurrence(store,snps)
+    with trace.stage('haplotype.triples'):
+        HaplotypeEngine.haplotypeSearch(store,snps,3,minCount,pairs=pairs)
+    with trace.stage('haplotype.counterparts'):
+        frequent = pairs[pairs['n Intersection'] >= minCount]
+        frequent = frequent[(frequent[['gtype 1','gtype 2']] != 'AB').all(axis=1)]
+        counterparts = HaplotypeEngine.findCounterparts(frequent)
+    with trace.stage('haplotype.comparison'):
+        cytPatients = {p:j for j, p in enumerate(cytTable['patient'].cat.categories)}
+        toCytTable = numpy.array([cytPatients.get(p,-1) for p in store.patients],dtype=numpy.intp)
+        groups = []
+        for pair in counterparts:
+            a = toCytTable[HaplotypeEngine.haplotypeMembers(store,pair[2])]
+            b = toCytTable[HaplotypeEngine.haplotypeMembers(store,pair[3])]
+            groups.append((a[a >= 0],b[b >= 0]))
+        HaplotypeEngine.checkHaplotypesCytokine(groups,cyts,cytTable,workers)
+    return stageTimes(trace)
+
+def benchControl(path,outputName,nSNPs=100,nPermutations=1000):
+    # SNPControlCheck.run on the scan's Table; its stages are the control timings
+    trace = Instrument.Trace(quiet=True)
+    SNPControlCheck.run(path,outputName + ' Table.csv',outputName + ' control.xlsx',nPermutations=nPermutations,seed=0,
+                        trace=trace,maxSNPs=nSNPs)
+    return {'control.' + stage:seconds for stage, seconds in stageTimes(trace).items()}
+
+def runSuite(sizeNames,dataDir,workers=1,quiet=True):
+    results = {}
+    for name in sizeNames:
+        nPatients, nSNPs, nMediators = sizes[name]
+        path = os.path.join(dataDir,'synthetic ' + name + '.csv')
+        if not os.path.exists(path):
+            print('Generating ' + name + ' cohort: ' + str(nPatients) + ' patients, ' + str(nSNPs) + ' SNPs, ' +
+                  str(nMediators) + ' mediators')
+            SyntheticCohort.writeCohort(path,nPatients,nSNPs,nMediators,seed=0)
+        outputName = os.path.join(dataDir,'benchmark ' + name)
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log if quiet else sys.stdout):
+            times, (store, cyts, cytTable, significanceCount) = benchScan(path,outputName,workers)
+            times.update(benchHaplotype(store,cyts,cytTable,workers=workers))
+            times.update(benchControl(path,outputName))
+        results[name] = times
+        for stage, seconds in times.items():
+            print(name.ljust(8) + stage.ljust(26) + ('%.3f' % seconds).rjust(10) + ' s')
+    return results
+
+def compare(results,baseline,tolerance=0.25,floor=0.1):
+    # stages slower than baseline by more than tolerance (and floor seconds)
+    regressions = []
+    for name, times in results.items():
+        for stage, seconds in times.items():
+            before = baseline.get(name,{}).get(stage)
+            if before is not None and seconds > before*(1 + tolerance) and seconds - before > floor:
+                regressions.append((name,stage,before,seconds))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time every pipeline stage on synthetic cohorts.')
+    parser.add_argument('--sizes',nargs='+',default=['tiny','small'],choices=list(sizes))
+    parser.add_argument('--data-dir',default=os.path.join(tempfile.gettempdir(),'SNPScanner benchmark'),
+                        help='where generated cohorts and outputs are kept between runs')
+    parser.add_argument('-j','--workers',type=int,default=1)
+    parser.add_argument('--repeat',type=int,default=1,help='keep the best of this many runs per stage')
+    parser.add_argument('--save',default=None,help='write the timings to this JSON file')
+    parser.add_argument('--baseline',default=None,help='JSON from an earlier --save to check for regressions')
+    parser.add_argument('--tolerance',type=float,default=0.25,help='allowed slowdown against the baseline (0.25 = 25%%)')
+    parser.add_argument('--verbose',action='store_true',help='show the pipelines\' own progress output')
+    args = parser.parse_args(argv)
+    os.makedirs(args.data_dir,exist_ok=True)
+    results = {}
+    for r in range(args.repeat):
+        for name, times in runSuite(args.sizes,args.data_dir,args.workers,not args.verbose).items():
+            best = results.setdefault(name,{})
+            for stage, seconds in times.items():
+                best[stage] = min(seconds,best.get(stage,seconds))
+    if args.save is not None:
+        with open(args.save,'w') as f:
+            json.dump({'sizes':{name:sizes[name] for name in args.sizes},'times':results},f,indent=1)
+    if args.baseline is not None:
+        with open(args.baseline,'r') as f:
+            baseline = json.load(f)['times']
+        regressions = compare(results,baseline,args.tolerance)
+        for name, stage, before, seconds in regressions:
+            print('Regression: ' + name + ' ' + stage + ' ' + ('%.3f' % before) + ' s -> ' + ('%.3f' % seconds) + ' s')
+        if len(regressions) > 0:
+            return 1
+        print('No regressions against ' + args.baseline)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
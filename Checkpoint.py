@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+'''
+Checkpoint
+
+Per-chunk result files for long scans. A directory holds a manifest (input
+file size, mtime and content hash plus run parameters) and one .npz file
+per finished chunk. A rerun with the same manifest picks the finished
+chunks back up; any change to the inputs or parameters starts the
+directory over. Like a SNPCache entry, the input is matched on its stat
+first and only hashed when that changed.
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import numpy
+
+import SNPCache
+
+def listDigest(items):
+    # short stable hash of a list of names, for manifests
+    digest = hashlib.blake2b(digest_size=16)
+    for item in items:
+        digest.update(str(item).encode('utf-8') + b'\n')
+    return digest.hexdigest()
+
+def checkpointDir(outputName):
+    return outputName + ' Checkpoint'
+
+def readManifest(path):
+    try:
+        with open(path,'r') as f:
+            return json.load(f)
+    except (IOError,ValueError):
+        return None
+
+def writeManifest(path,manifest):
+    with open(path,'w') as f:
+        json.dump(manifest,f,indent=1,sort_keys=True)
+
+class Checkpoint(object):
+    def __init__(self,directory,manifest):
+        self.directory = directory
+        self.manifest = json.loads(json.dumps(manifest,sort_keys=True))
+        self.manifestPath = os.path.join(directory,'manifest.json')
+        if readManifest(self.manifestPath) != self.manifest:
+            shutil.rmtree(directory,ignore_errors=True)
+            os.makedirs(directory)
+            writeManifest(self.manifestPath,self.manifest)
+        finished = len(self.finished())
+        if finished > 0:
+            print('Resuming from checkpoint: ' + str(finished) + ' chunks done')
+
+    @classmethod
+    def forInput(cls,outputName,path,parameters,inputHash=None):
+        # manifest of the run parameters and the input file's stat and content hash; the
+        # file is hashed only when a saved manifest of the same parameters has another stat,
+        # so a run that starts fresh or resumes an untouched input never reads it through.
+        # inputHash saves that hashing when the caller already has it
+        directory = checkpointDir(outputName)
+        stat = os.stat(path)
+        manifest = json.loads(json.dumps(dict(parameters,input=inputHash,inputStat=[stat.st_size,stat.st_mtime]),sort_keys=True))
+        manifestPath = os.path.join(directory,'manifest.json')
+        saved = readManifest(manifestPath)
+        inputKeys = ('input','inputStat')
+        if isinstance(saved,dict) and set(saved) == set(manifest) and all(saved[k] == manifest[k] for k in manifest if k not in inputKeys):
+            if saved['inputStat'] == manifest['inputStat']:
+                manifest['input'] = saved['input']
+            else:
+                manifest['input'] = SNPCache.fileHash(path) if inputHash is None else inputHash
+                if saved['input'] == manifest['input']:
+                    writeManifest(manifestPath,manifest)#same content, touched since: keep its chunks
+        return cls(directory,manifest)
+
+    def chunkPath(self,chunk):
+        return os.path.join(self.directory,'chunk%06d.npz' % chunk)
+
+    def finished(self):
+        return sorted(int(name[5:11]) for name in os.listdir(self.directory) if name.startswith('chunk') and name.endswith('.npz'))
+
+    def has(self,chunk):
+        return os.path.exists(self.chunkPath(chunk))
+
+    def load(self,chunk,*names):
+        with numpy.load(self.chunkPath(chunk),allow_pickle=False) as saved:
+            return [saved[name] for name in names]
+
+    def save(self,chunk,**arrays):
+        # written under a temporary name first, so a crash never leaves half a chunk
+        tmpPath = os.path.join(self.directory,'partial%06d.npz' % chunk)
+        with open(tmpPath,'wb') as f:
+            numpy.savez(f,**arrays)
+        os.replace(tmpPath,self.chunkPath(chunk))
+
+    def remove(self):
+        shutil.rmtree(self.directory,ignore_errors=True)
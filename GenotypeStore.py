@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+'''
+GenotypeStore
+
+Compact SNP x patient genotype matrix. Calls are held as int8 codes
+(AA=0, AB=1, BB=2, missing=-1) with SNP name -> row and patient -> column
+indices, so the string sheet only has to be walked once at load time.
+'''
+
+import numpy
+import pandas
+
+AA = 0
+AB = 1
+BB = 2
+MISSING = -1
+gtypes = ['AA','AB','BB']
+
+def encodeCalls(values):
+    values = numpy.asarray(values,dtype=object)
+    calls = numpy.full(values.shape,MISSING,dtype=numpy.int8)
+    for code in range(len(gtypes)):
+        calls[values == gtypes[code]] = code
+    return calls
+
+class GenotypeStore(object):
+    def __init__(self,calls,snpNames,patients,rows=None):
+        self.calls = numpy.asarray(calls,dtype=numpy.int8)
+        self.snpNames = list(snpNames)
+        self.patients = list(patients)
+        self.rows = numpy.arange(len(self.snpNames)) if rows is None else numpy.asarray(rows)
+        self.snpIndex = {}
+        for i in range(len(self.snpNames)):
+            self.snpIndex.setdefault(self.snpNames[i],i)#first row wins, as with .index[0]
+        self.patientIndex = {self.patients[j]:j for j in range(len(self.patients))}
+
+    @classmethod
+    def fromFrame(cls,data,rows,patients,nameCol='Name',chunksize=15000):
+        rows = list(rows)
+        patients = list(patients)
+        calls = numpy.empty((len(rows),len(patients)),dtype=numpy.int8)
+        for start in range(0,len(rows),chunksize):
+            chunkRows = rows[start:start+chunksize]
+            calls[start:start+len(chunkRows),:] = encodeCalls(data.loc[chunkRows,patients].to_numpy())
+        snpNames = list(data.loc[rows,nameCol])
+        return cls(calls,snpNames,patients,rows)
+
+    def __len__(self):
+        return len(self.snpNames)
+
+    def row(self,snp):
+        return self.calls[self.snpIndex[snp],:]
+
+    def firstRows(self):
+        # mask of the rows snpIndex keeps: the first row of each SNP name
+        first = numpy.zeros(len(self.snpNames),dtype=bool)
+        first[list(self.snpIndex.values())] = True
+        return first
+
+    def patientsWith(self,snp,code):
+        line = self.row(snp)
+        return [self.patients[j] for j in numpy.flatnonzero(line == code)]
+
+    def partition(self,snp):
+        # [AA patients, AB patients, BB patients]
+        return [self.patientsWith(snp,code) for code in range(len(gtypes))]
+
+    def mask(self,code,snps=None):
+        calls = self.calls if snps is None else self.calls[[self.snpIndex[s] for s in snps],:]
+        return calls == code
+
+    def counts(self,chunksize=4096):
+        # per SNP: AA count, AB count, BB count, called count
+        # one pass over the matrix, a cache-sized block of SNP rows at a time
+        nCounts = numpy.zeros((len(self.snpNames),len(gtypes)),dtype=numpy.int64)
+        for start in range(0,len(self.snpNames),chunksize):
+            block = self.calls[start:start+chunksize,:]
+            for code in range(len(gtypes)):
+                nCounts[start:start+len(block),code] = numpy.count_nonzero(block == code,axis=1)
+        nAA, nAB, nBB = nCounts[:,AA], nCounts[:,AB], nCounts[:,BB]
+        return nAA, nAB, nBB, nAA + nAB + nBB
+
+    def genotypedPatients(self,codes=(AA,BB)):
+        hasCall = numpy.zeros(len(self.patients),dtype=bool)
+        for code in codes:
+            hasCall |= (self.calls == code).any(axis=0)
+        return [self.patients[j] for j in numpy.flatnonzero(hasCall)]
+
+    def subset(self,snps=None,patients=None):
+        snpRows = numpy.arange(len(self.snpNames)) if snps is None else numpy.array([self.snpIndex[s] for s in snps],dtype=int)
+        patients = self.patients if patients is None else list(patients)
+        patCols = numpy.array([self.patientIndex[p] for p in patients],dtype=int)
+        return GenotypeStore(self.calls[numpy.ix_(snpRows,patCols)],
+                             [self.snpNames[i] for i in snpRows],patients,self.rows[snpRows])
+
+    def take(self,rows):
+        # rows: positions or a boolean mask over SNP rows
+        rows = numpy.flatnonzero(rows) if numpy.asarray(rows).dtype == bool else numpy.asarray(rows,dtype=int)
+        return GenotypeStore(self.calls[rows,:],[self.snpNames[i] for i in rows],self.patients,self.rows[rows])
+
+    @classmethod
+    def concat(cls,stores,patients=None):
+        # stack SNP blocks that share the same patient columns
+        stores = list(stores)
+        if len(stores) == 0:
+            return cls(numpy.zeros((0,len(patients or [])),dtype=numpy.int8),[],patients or [])
+        return cls(numpy.concatenate([s.calls for s in stores],axis=0),
+                   [name for s in stores for name in s.snpNames],stores[0].patients,
+                   numpy.concatenate([s.rows for s in stores]))
+
+    def toFrame(self):
+        labels = numpy.array(gtypes + [None],dtype=object)
+        return pandas.DataFrame(labels[self.calls],index=self.snpNames,columns=self.patients)
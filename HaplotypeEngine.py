@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+'''
+HaplotypeEngine
+
+Headless haplotype detection and haplotype-vs-counterpart mediator comparison
+behind HaplotypeHelper. Also reachable as "python SNPEngine.py haplotype".
+'''
+
+import numpy
+import pandas
+import re
+
+import BatchMWU
+import Checkpoint
+import Instrument
+import SNPIndex
+import SNPParallel
+import SNPReader
+from SNPEngine import buildCytokineTable, mediatorObservations, testMediators
+from GenotypeStore import GenotypeStore, gtypes
+
+class ParamsNotFound(ValueError):
+    # none of the requested mediator parameters are in the data set
+    pass
+
+def parseSNPs(text):
+    snps_ = re.split(r'\s',text)
+    snps_ = list(dict.fromkeys(snps_))#Removes duplicates, keeping the entered order
+    return [s for s in snps_ if len(s) > 0]#Removes null entries Python dectects
+
+def genotypeIndicators(store,snps):
+    # 0/1 matrix of (SNP, genotype) x patient; row 3*k+g is SNP k with genotype g
+    calls = store.calls[[store.snpIndex[s] for s in snps],:]
+    indicators = calls[:,None,:] == numpy.arange(len(gtypes),dtype=numpy.int8)[None,:,None]
+    return indicators.reshape(len(snps)*len(gtypes),-1).astype(numpy.float32)
+
+def haplotypeMembers(store,key):
+    # store column indices of the patients carrying haplotype (SNP 1, gtype 1, SNP 2, gtype 2, ...)
+    carries = numpy.ones(len(store.patients),dtype=bool)
+    for snp, gtype in zip(key[0::2],key[1::2]):
+        carries &= store.row(snp) == gtypes.index(gtype)
+    return numpy.flatnonzero(carries)
+
+def haplotypeName(key):
+    return ' & '.join([snp + ' ' + gtype for snp, gtype in zip(key[0::2],key[1::2])])
+
+def pairCooccurrence(store,snps,blockSize=256):
+    # Every SNP pair x genotype pair intersection count from one indicator
+    # matrix product per block of SNPs; no patient lists are built here.
+    # Pairs come out in the old get2SNPCombos order: (last, first), (last, second), ...
+    nSNPs = len(snps)
+    nG = len(gtypes)
+    indicators = genotypeIndicators(store,snps)
+    sizes = indicators.sum(axis=1).reshape(nSNPs,nG).astype(numpy.int64)
+    frames = []
+    order = numpy.arange(nSNPs-1,0,-1)
+    for blockStart in range(0,len(order),blockSize):
+        ks = order[blockStart:blockStart+blockSize]
+        rows = (ks[:,None]*nG + numpy.arange(nG)[None,:]).ravel()
+        counts = (indicators[rows] @ indicators[:ks[0]*nG].T).round().astype(numpy.int64)
+        counts = counts.reshape(len(ks),nG,ks[0],nG).transpose(0,2,1,3)#k, j, gtype1, gtype2
+        k, j, g1, g2 = numpy.meshgrid(ks,numpy.arange(ks[0]),numpy.arange(nG),numpy.arange(nG),indexing='ij')
+        n1 = sizes[k,g1]
+        n2 = sizes[j,g2]
+        keep = (j < k[:,:1,:,:]) & (n1 > 0) & (n2 > 0)
+        k, j, g1, g2, n1, n2, nInt = k[keep], j[keep], g1[keep], g2[keep], n1[keep], n2[keep], counts[keep]
+        frames.append(pandas.DataFrame({'SNP 1':numpy.array(snps,dtype=object)[k],
+                                        'gtype 1':numpy.array(gtypes,dtype=object)[g1],
+                                        'n 1':n1,
+                                        'SNP 2':numpy.array(snps,dtype=object)[j],
+                                        'gtype 2':numpy.array(gtypes,dtype=object)[g2],
+                                        'n 2':n2,
+                                        'n Intersection':nInt,
+                                        '% 1 Represented':nInt/n1,
+                                        '% 2 Represented':nInt/n2}))
+    resultDF = pandas.DataFrame(columns=['SNP 1', 'gtype 1', 'n 1', 'SNP 2', 'gtype 2', 'n 2',
+                                         'n Intersection', '% 1 Represented', '% 2 Represented'])
+    if len(frames) > 0:
+        resultDF = pandas.concat(frames,ignore_index=True)
+    return resultDF
+
+def itemBits(store,snps):
+    # packed patient bitsets, one row per (SNP, genotype) item; item 3*k+g is SNP k with genotype g
+    calls = store.calls[[store.snpIndex[s] for s in snps],:]
+    indicators = calls[:,None,:] == numpy.arange(len(gtypes),dtype=numpy.int8)[None,:,None]
+    return numpy.packbits(indicators.reshape(len(snps)*len(gtypes),-1),axis=1)
+
+bitsSet = numpy.array([bin(b).count('1') for b in range(256)],dtype=numpy.uint8)
+
+def bitCount(bits):
+    return bitsSet[bits].sum(axis=-1,dtype=numpy.int64)
+
+def frequentPairs(resultDF,snps,minCount):
+    # 2-SNP results -> sorted item pairs whose intersection meets minCount, and those counts
+    snpPos = {snps[k]:k for k in range(len(snps))}
+    gPos = {gtypes[g]:g for g in range(len(gtypes))}
+    frequent = resultDF[resultDF['n Intersection'] >= minCount]
+    item1 = frequent['SNP 1'].map(snpPos).to_numpy()*len(gtypes) + frequent['gtype 1'].map(gPos).to_numpy()
+    item2 = frequent['SNP 2'].map(snpPos).to_numpy()*len(gtypes) + frequent['gtype 2'].map(gPos).to_numpy()
+    itemsets = numpy.sort(numpy.column_stack([item1,item2]).astype(numpy.int32),axis=1)
+    order = numpy.lexsort(itemsets.T[::-1])
+    return itemsets[order], frequent['n Intersection'].to_numpy(dtype=numpy.int64)[order]
+
+def extendItemsets(itemsets,bits,minCount,batchSize=2**16):
+    # Apriori join: two frequent k-sets sharing their first k-1 items give one
+    # (k+1)-candidate, kept only if its intersection still meets minCount.
+    # itemsets must be sorted row-wise and lexicographically; so is the result.
+    nG = len(gtypes)
+    found = [numpy.zeros((0,itemsets.shape[1]+1),dtype=numpy.int32)]
+    counts = [numpy.zeros(0,dtype=numpy.int64)]
+    newPrefix = numpy.r_[True,(itemsets[1:,:-1] != itemsets[:-1,:-1]).any(axis=1)]
+    bounds = numpy.r_[numpy.flatnonzero(newPrefix),len(itemsets)]
+    for start, stop in zip(bounds[:-1],bounds[1:]):
+        if stop - start < 2:
+            continue
+        prefix = itemsets[start,:-1]
+        prefixBits = numpy.bitwise_and.reduce(bits[prefix],axis=0)
+        lasts = itemsets[start:stop,-1]
+        #candidate pairs (i < j) of the group, a block of i rows at a time
+        rowBlock = max(1,batchSize // len(lasts))
+        for r in range(0,len(lasts),rowBlock):
+            i, j = numpy.meshgrid(numpy.arange(r,min(len(lasts),r+rowBlock)),numpy.arange(len(lasts)),indexing='ij')
+            keep = (j > i) & (lasts[i] // nG != lasts[j] // nG)#one genotype per SNP
+            a, b = lasts[i[keep]], lasts[j[keep]]
+            n = bitCount(bits[a] & bits[b] & prefixBits)
+            frequent = n >= minCount
+            found.append(numpy.column_stack([numpy.repeat(prefix[None,:],frequent.sum(),axis=0),a[frequent],b[frequent]]).astype(numpy.int32))
+            counts.append(n[frequent])
+    return numpy.concatenate(found), numpy.concatenate(counts)
+
+def haplotypeSearch(store,snps,nHaplo,minCount=20,pairs=None):
+    # every nHaplo-SNP haplotype carried by at least minCount patients,
+    # grown level by level from the frequent 2-SNP haplotypes
+    if pairs is None:
+        pairs = pairCooccurrence(store,snps)
+    bits = itemBits(store,snps)
+    sizes = bitCount(bits)
+    itemsets, nInt = frequentPairs(pairs,snps,minCount)
+    for level in range(3,nHaplo+1):
+        itemsets, nInt = extendItemsets(itemsets,bits,minCount)
+        print(str(level) + '-SNP haplotypes: ' + str(len(itemsets)))
+    #columns in SNP order, as in pairCooccurrence's tables
+    columns = {}
+    for h in range(nHaplo):
+        tag = str(h + 1)
+        columns['SNP ' + tag] = numpy.array(snps,dtype=object)[itemsets[:,h] // len(gtypes)]
+        columns['gtype ' + tag] = numpy.array(gtypes,dtype=object)[itemsets[:,h] % len(gtypes)]
+        columns['n ' + tag] = sizes[itemsets[:,h]]
+    columns['n Intersection'] = nInt
+    for h in range(nHaplo):
+        tag = str(h + 1)
+        columns['% ' + tag + ' Represented'] = nInt/columns['n ' + tag]
+    return pandas.DataFrame(columns)
+
+def findCounterparts(dfResult,nHaplo=2):
+    # pair each haplotype with its 'opposite', every AA flipped to BB and back
+    # (e.g. (SNP1 AA & SNP2 BB) vs. (SNP1 BB & SNP2 AA)); the relation is
+    # symmetric, so each pair is reported once, at its first row
+    keyCols = [c + ' ' + str(h + 1) for h in range(nHaplo) for c in ['SNP','gtype']]
+    otherCols = ['other ' + str(h + 1) for h in range(nHaplo)]
+    rows = dfResult[keyCols].reset_index(drop=True)
+    rows['position'] = numpy.arange(len(rows))
+    opposite = {'AA':'BB','BB':'AA'}
+    for h in range(nHaplo):
+        rows[otherCols[h]] = rows['gtype ' + str(h + 1)].map(opposite)
+    firsts = rows.drop_duplicates(keyCols)
+    lookup = firsts.set_index(keyCols)['position']
+    flipped = pandas.MultiIndex.from_arrays([rows[c] for h in range(nHaplo) for c in ['SNP ' + str(h + 1),otherCols[h]]])
+    counterpart = lookup.reindex(flipped).to_numpy()
+    isFirst = numpy.zeros(len(rows),dtype=bool)
+    isFirst[firsts['position'].to_numpy()] = True
+    keep = isFirst & ~numpy.isnan(counterpart) & (numpy.nan_to_num(counterpart,nan=-1) > rows['position'].to_numpy())
+    counts = dfResult['n Intersection'].to_numpy()
+    keys = list(zip(*[rows[c].to_numpy(dtype=object) for c in keyCols]))
+    pairs = []
+    for i, c in zip(numpy.flatnonzero(keep),counterpart[keep].astype(int)):
+        pairs.append((haplotypeName(keys[i]),haplotypeName(keys[c]),keys[i],keys[c],counts[i],counts[c]))
+    return pairs
+
+def checkHaplotypesCytokine(groups,cyts,cytTable,workers=4,checkpoint=None,chunkSize=4096,trace=None):
+    # groups: [(patient indices of haplotype, of its counterpart), ...] into
+    # cytTable's patient categories, tested a chunk of groups at a time;
+    # chunks already in checkpoint are read back instead of retested.
+    # trace gets progress within a chunk too; when it is cancelled the run
+    # stops part way through the current chunk and only the chunks
+    # finished before it are returned
+    patients = list(cytTable['patient'].cat.categories)
+    observations = mediatorObservations(cytTable)
+    rankedList = [BatchMWU.rankObservations(*observations[cyt]) for cyt in cyts]
+    shape = (len(groups),len(cyts))
+    U, p = numpy.zeros(shape), numpy.zeros(shape)
+    n1, n2 = numpy.zeros(shape,dtype=numpy.int64), numpy.zeros(shape,dtype=numpy.int64)
+    done = 0
+    pool = None
+    if trace is not None:
+        def chunkProgress(tested,total):
+            # progress inside the current chunk, so a single-chunk run still reports and cancels
+            trace.progress(start + len(chunkGroups)*tested/max(1,total),len(groups),'pairs')
+            if trace.cancelled:
+                raise Instrument.Cancelled()
+    else:
+        chunkProgress = None
+    try:
+        for start in range(0,len(groups),chunkSize):
+            chunkGroups = groups[start:start+chunkSize]
+            chunk = start // chunkSize
+            try:
+                if checkpoint is not None and checkpoint.has(chunk):
+                    results = checkpoint.load(chunk,'U','p','n1','n2')
+                else:
+                    if workers > 1 and pool is None:
+                        pool = SNPParallel.MediatorPool(rankedList,len(patients),workers)
+                    if pool is not None:
+                        results = pool.testGroups(chunkGroups,progress=chunkProgress)
+                    else:
+                        maskAA = numpy.zeros((len(chunkGroups),len(patients)),dtype=bool)
+                        maskBB = numpy.zeros((len(chunkGroups),len(patients)),dtype=bool)
+                        for i in range(len(chunkGroups)):
+                            maskAA[i,chunkGroups[i][0]] = True
+                            maskBB[i,chunkGroups[i][1]] = True
+                        results = testMediators(rankedList,maskAA,maskBB,chunkProgress)
+                    if checkpoint is not None:
+                        checkpoint.save(chunk,U=results[0],p=results[1],n1=results[2],n2=results[3])
+            except Instrument.Cancelled:
+                print('Cancelled after ' + str(done) + ' of ' + str(len(groups)) + ' haplotype pairs')
+                break
+            stop = start + len(chunkGroups)
+            U[start:stop], p[start:stop], n1[start:stop], n2[start:stop] = results
+            done = stop
+            if trace is not None:
+                trace.progress(done,len(groups),'pairs')
+                if trace.cancelled and done < len(groups):
+                    print('Cancelled after ' + str(done) + ' of ' + str(len(groups)) + ' haplotype pairs')
+                    break
+    finally:
+        if pool is not None and done < len(groups):
+            pool.terminate()
+        elif pool is not None:
+            pool.close()
+    return U[:done], p[:done], n1[:done], n2[:done]
+
+def findParams(data,params):
+    return [param for param in params if any(data.iloc[:, 0].str.contains(param, na=False))]
+
+def readCohort(patientFile,patientSheet='Deriv Total'):
+    pittFile = pandas.read_excel(patientFile,sheet_name=patientSheet,header=0)
+    hr1pats_ = list(pittFile.loc[:,'patient_id'])
+    return [str(h) for h in hr1pats_ if h==h]
+
+def run(nHaplo,params,snps,path,sheet,outputName,patientFile=None,patientSheet='Deriv Total',onMissingParams=None,cache=None,
+        workers=4,minCount=20,checkpoint=True,trace=None):
+    # onMissingParams() is asked whether to go on when only some params are present;
+    # checkpoint keeps finished comparison chunks in '<outputName> Checkpoint' until the outputs are written;
+    # trace (Instrument.Trace) records the stages and counters of the run; a
+    # run cancelled while comparing writes the pairs finished and keeps its checkpoint
+    if len(snps) < 2:
+        raise ValueError('Enter at least 2 SNPs to be compared.')
+    trace = Instrument.Trace() if trace is None else trace
+    with trace.stage('read'):
+        data = SNPReader.readFile(path, sheet, cache=cache)
+    paramsPresent = findParams(data,params)
+    if len(paramsPresent) < 1:
+        raise ParamsNotFound('Parameters given not found in data set.')
+    if len(params) > len(paramsPresent):
+        if onMissingParams is not None and not onMissingParams():
+            return None
+        print('Parameters not found: ' + ', '.join([p for p in params if p not in paramsPresent]))
+    #Reduce database to necessary patients, SNPs, and parameters
+    with trace.stage('reduce'):
+        startSNPS = data[data.Chr.notnull()].index[0]
+        snpIndices = SNPIndex.SNPIndex.forFile(path,sheet,cache=cache,data=data).rows(snps)
+        timeIndices = list(data[data['patient_id'].map(lambda x: x == 'time')].index)
+        preCytokinesCols = sorted(set(data.iloc[timeIndices[0]:startSNPS, 0].dropna(axis=0)))
+        cyts = [c for c in preCytokinesCols if any(re.findall(r'|'.join(paramsPresent), c, re.IGNORECASE))]
+        if len(cyts) < 1:
+            raise ParamsNotFound('Parameters given not found in data set.')
+        cytokineIndices = {}
+        for cyt in cyts:
+            cytokineIndices[cyt] = list(data[data['patient_id'].map(lambda x: x == cyt)].index)
+        cytokineIndices['time'] = timeIndices
+        cytIndVals = [*cytokineIndices.values()]
+        allRows = sorted([val for cyt in cytIndVals for val in cyt])
+        if patientFile is not None:
+            hr1pats = readCohort(patientFile,patientSheet)
+            keepCols = [c for c in list(data.columns) if c in hr1pats]
+        else:
+            keepCols = list(data.columns)[12:]
+        print('Patients: ' + str(len(keepCols)))
+        store = GenotypeStore.fromFrame(data,snpIndices,keepCols)
+        data = data.loc[allRows, keepCols]
+    with trace.stage('cytokines'):
+        cytTable = buildCytokineTable(data,cytokineIndices,keepCols)
+    with trace.stage('cooccurrence'):
+        resultDF = pairCooccurrence(store,snps)
+        if nHaplo > 2:
+            resultDF = haplotypeSearch(store,snps,nHaplo,minCount,pairs=resultDF)
+        dfResult = resultDF[resultDF['n Intersection'] >= minCount]
+        resultDF = resultDF.sort_values('n Intersection',ascending=False,kind='mergesort')
+    trace.count('haplotypes counted',len(resultDF))
+    trace.count('haplotypes frequent',len(dfResult))
+    with trace.stage('write'):
+        resultDF.to_csv(outputName + '.csv',index=False,sep=',',mode='w',chunksize=15000)
+    #compare inflammation of haplotypes with their 'opposites' (e.g. (SNP1 AA & SNP2 BB) vs. (SNP1 BB & SNP2 AA))
+    with trace.stage('counterparts'):
+        gtypeCols = ['gtype ' + str(h + 1) for h in range(nHaplo)]
+        dfResult = dfResult[(dfResult[gtypeCols] != 'AB').all(axis=1)]
+        pairs = findCounterparts(dfResult,nHaplo)
+        # send all patient lists to MWU at once
+        cytPatients = {p:j for j, p in enumerate(cytTable['patient'].cat.categories)}
+        toCytTable = numpy.array([cytPatients[p] for p in store.patients],dtype=numpy.intp)
+        groups = [(toCytTable[haplotypeMembers(store,pair[2])],toCytTable[haplotypeMembers(store,pair[3])]) for pair in pairs]
+    trace.count('counterpart pairs',len(pairs))
+    chunkSize = 4096
+    resume = None
+    if checkpoint:
+        resume = Checkpoint.Checkpoint.forInput(outputName,path,{'stage':'haplotype','sheet':sheet,'mediators':cyts,
+                                                                  'patients':Checkpoint.listDigest(keepCols),
+                                                                  'pairs':Checkpoint.listDigest([pair[0] for pair in pairs]),
+                                                                  'chunkSize':chunkSize},
+                                                None if cache is None else cache.knownHash(path))
+    with trace.stage('test'):
+        U, p, n1, n2 = checkHaplotypesCytokine(groups,cyts,cytTable,workers,resume,chunkSize,trace)
+        finished = len(pairs) == len(U)
+        pairs = pairs[:len(U)]
+        tested = (n1 > 0) & (n2 > 0) & ~numpy.isnan(p)
+    trace.count('tests run',p.size)
+    trace.count('tests skipped for empty groups',int((~tested).sum()))
+    with trace.stage('write',cancellable=False):
+        results2 = []
+        for i in range(len(pairs)):
+            t = tested[i]
+            results2.append(pandas.DataFrame({'HType 1':pairs[i][0],
+                                              'HType 2':pairs[i][1],
+                                              'Mediator':numpy.array(cyts,dtype=object)[t],
+                                              'p Value':p[i,t],
+                                              'Mann-Whitney U Score':U[i,t],
+                                              'Count 1':pairs[i][4],
+                                              'Count 2':pairs[i][5]}))
+        cytResult = pandas.DataFrame(columns=['HType 1','HType 2','Mediator','p Value','Mann-Whitney U Score','Count 1','Count 2'])
+        if len(results2) > 0:
+            cytResult = pandas.concat(results2,axis=0,ignore_index=True)
+        cytResult = cytResult.sort_values('p Value',ascending=False,kind='mergesort')
+        shortDF = pandas.DataFrame({'Group 1':[pair[0] for pair in pairs],
+                                    'n 1':[pair[4] for pair in pairs],
+                                    'Group 2':[pair[1] for pair in pairs],
+                                    'n 2':[pair[5] for pair in pairs],
+                                    '# Significant Cyts':(tested & (p < 0.05)).sum(axis=1)},
+                                   columns=['Group 1','n 1','Group 2','n 2','# Significant Cyts'])
+        shortDF = shortDF.sort_values('# Significant Cyts',kind='mergesort')
+        cytResult.to_csv(outputName + ' HType Report.csv',index=False,sep=',',mode='w',chunksize=15000)
+        shortDF.to_csv(outputName + ' HType Table.csv',index=False,sep=',',mode='w',chunksize=15000)
+    trace.count('rows written',len(resultDF) + len(cytResult) + len(shortDF))
+    if resume is not None and finished:
+        resume.remove()
+    return cytResult, shortDF
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+'''
+Instrument
+
+Per-run trace of the pipeline stages: wall and CPU time, peak memory and
+named counters (SNPs screened, tests run, rows written, ...). A trace can
+be written as JSON or CSV, and one chosen stage can be run under cProfile.
+A listener can follow the run's progress, and cancel() asks the pipeline
+to stop at the next stage or block boundary.
+Python allocation peaks (tracemalloc) are only recorded when asked for, as
+tracing slows the run down; the process peak RSS is always recorded where
+the platform reports it.
+'''
+
+import os
+import io
+import sys
+import csv
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+import contextlib
+import collections
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+stageColumns = ['stage','wall s','cpu s','peak traced MB','peak RSS MB']
+
+def cpuSeconds():
+    # user + system time of this process and its finished child processes
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+def peakRSS():
+    # peak resident set size of this process so far, in MB (None where unknown)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/2**20 if sys.platform == 'darwin' else peak/2**10
+
+class Cancelled(Exception):
+    pass
+
+class Trace(object):
+    # memory: also record each stage's peak of traced Python allocations;
+    # profile: name of the stage to run under cProfile; quiet: no stage prints;
+    # listener(stage, fraction, rate, eta, unit) is told of stage starts
+    # (fraction None) and of progress() within a stage
+    def __init__(self,memory=False,profile=None,quiet=False,listener=None):
+        self.memory = memory
+        self.profile = profile
+        self.quiet = quiet
+        self.listener = listener
+        self.cancelled = False
+        self.current = None
+        self.currentStart = None
+        self.stages = []
+        self.counters = collections.OrderedDict()
+        self.profiles = {}
+        self.started = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    @contextlib.contextmanager
+    def stage(self,name,cancellable=True):
+        # a cancelled run raises Cancelled on entering a cancellable stage
+        if cancellable and self.cancelled:
+            raise Cancelled(name)
+        if not self.quiet:
+            print(name + '...')
+        self.current, self.currentStart = name, time.perf_counter()
+        if self.listener is not None:
+            self.listener(name,None,None,None,None)
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        profiler = cProfile.Profile() if name == self.profile else None
+        wall, cpu = time.perf_counter(), cpuSeconds()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield self
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.profiles[name] = profiler
+            record = {'stage':name,'wall s':time.perf_counter() - wall,'cpu s':cpuSeconds() - cpu,
+                      'peak traced MB':tracemalloc.get_traced_memory()[1]/2**20 if self.memory else None,
+                      'peak RSS MB':peakRSS()}
+            self.stages.append(record)
+            if not self.quiet:
+                print(name + ': ' + '%.3f' % record['wall s'] + ' s')
+
+    def cancel(self):
+        # may be called from another thread; the pipeline checks it between blocks
+        self.cancelled = True
+
+    def progress(self,done,total,unit='items'):
+        # done of total units of the current stage finished
+        if self.listener is None or total <= 0:
+            return
+        elapsed = time.perf_counter() - self.currentStart
+        rate = done/elapsed if elapsed > 0 else None
+        eta = (total - done)/rate if rate else None
+        self.listener(self.current,done/total,rate,eta,unit)
+
+    def count(self,name,n=1):
+        self.counters[name] = self.counters.get(name,0) + int(n)
+
+    def seconds(self,name):
+        # total wall time of the stages with this name
+        return sum(record['wall s'] for record in self.stages if record['stage'] == name)
+
+    def profileText(self,name,limit=30):
+        out = io.StringIO()
+        pstats.Stats(self.profiles[name],stream=out).sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+    def write(self,path):
+        # .csv: one row per stage then one per counter; anything else is JSON.
+        # A profiled stage is also dumped next to it as '<path> <stage>.prof'
+        if path.endswith('.csv'):
+            with open(path,'w',newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(stageColumns + ['counter','count'])
+                for record in self.stages:
+                    writer.writerow(['' if record[c] is None else record[c] for c in stageColumns] + ['',''])
+                for name, n in self.counters.items():
+                    writer.writerow(['']*len(stageColumns) + [name,n])
+        else:
+            with open(path,'w') as f:
+                json.dump({'started':self.started,'stages':self.stages,'counters':self.counters},f,indent=1)
+        for name, profiler in self.profiles.items():
+            profiler.dump_stats(os.path.splitext(path)[0] + ' ' + name + '.prof')
+        return path
+
+    def report(self):
+        # the stage table and counters as printable text
+        lines = [name.ljust(32) + ('%.3f' % self.seconds(name)).rjust(10) + ' s'
+                 for name in dict.fromkeys(record['stage'] for record in self.stages)]
+        lines += [name.ljust(32) + str(n).rjust(10) for name, n in self.counters.items()]
+        return '\n'.join(lines)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+'''
+PermutationNull
+
+Empirical null for the control-SNP outcome tests. For each SNP the AA/BB
+labels are shuffled among its genotyped patients in batches of label
+matrices, all tested against outcome observations ranked once
+(BatchMWU). Each SNP stops early once every permutation p-value is
+confidently above alpha.
+'''
+
+import time
+import numpy
+import pandas
+import scipy.stats
+
+import BatchMWU
+
+def shuffledMasks(rng,labeled,nA,nPatients,batchSize):
+    # batchSize relabelings of the labeled patients keeping the group sizes
+    shuffled = rng.permuted(numpy.tile(labeled,(batchSize,1)),axis=1)
+    rows = numpy.arange(batchSize)[:,None]
+    maskA = numpy.zeros((batchSize,nPatients),dtype=bool)
+    maskB = numpy.zeros((batchSize,nPatients),dtype=bool)
+    maskA[rows,shuffled[:,:nA]] = True
+    maskB[rows,shuffled[:,nA:]] = True
+    return maskA, maskB
+
+def clearlyAbove(hits,done,alpha,confidence):
+    # Clopper-Pearson lower bound of hits/done already above alpha
+    lower = numpy.where(hits > 0,scipy.stats.beta.ppf((1 - confidence)/2,numpy.maximum(hits,1),done - hits + 1),0.)
+    return lower > alpha
+
+def permutationTest(rankedList,maskA,maskB,nPermutations=10000,batchSize=1000,alpha=0.05,confidence=0.999,rng=None):
+    # maskA, maskB: the observed partition over patients; returns the observed
+    # p per outcome and Significance Count, their permutation p-values, the
+    # null Significance Count histogram and the permutations actually run
+    rng = numpy.random.default_rng(rng)
+    nOut = len(rankedList)
+    observed = numpy.array([BatchMWU.mannWhitneyRanked(r,maskA[None,:],maskB[None,:])[1][0] for r in rankedList])
+    obsCount = int((observed < alpha).sum())
+    labeled = numpy.flatnonzero(maskA | maskB)
+    nA = int(maskA.sum())
+    hits = numpy.zeros(nOut + 1,dtype=numpy.int64)#each outcome, then Significance Count
+    nullCounts = numpy.zeros(nOut + 1,dtype=numpy.int64)
+    untestable = numpy.r_[numpy.isnan(observed),False]
+    done = 0
+    while done < nPermutations:
+        batch = min(batchSize,nPermutations - done)
+        permA, permB = shuffledMasks(rng,labeled,nA,len(maskA),batch)
+        p = numpy.column_stack([BatchMWU.mannWhitneyRanked(r,permA,permB)[1] for r in rankedList])
+        counts = (p < alpha).sum(axis=1)
+        hits[:-1] += (p <= observed[None,:]).sum(axis=0)
+        hits[-1] += (counts >= obsCount).sum()
+        nullCounts += numpy.bincount(counts,minlength=nOut + 1)
+        done += batch
+        if (untestable | clearlyAbove(hits,done,alpha,confidence)).all():
+            break
+    pPerm = numpy.where(untestable,numpy.nan,(hits + 1)/(done + 1))
+    return observed, obsCount, pPerm, nullCounts, done
+
+def permutationNull(rankedList,outcomes,snps,maskAA,maskBB,nPermutations=10000,seed=None,**options):
+    # rankedList: BatchMWU.rankObservations per outcome; maskAA/maskBB: SNPs x patients.
+    # Every SNP gets its own stream from seed, so results do not depend on SNP order.
+    startTime = time.time()
+    streams = numpy.random.SeedSequence(seed).spawn(len(snps))
+    results = []
+    nullCounts = []
+    for i in range(len(snps)):
+        observed, obsCount, pPerm, counts, done = permutationTest(rankedList,maskAA[i],maskBB[i],nPermutations,
+                                                                  rng=numpy.random.default_rng(streams[i]),**options)
+        row = {'SNP':snps[i]}
+        for o in range(len(outcomes)):
+            row[outcomes[o] + ' pVal'] = observed[o]
+            row[outcomes[o] + ' Perm pVal'] = pPerm[o]
+        row['Significance Count'] = obsCount
+        row['Significance Count Perm pVal'] = pPerm[-1]
+        row['Permutations'] = done
+        results.append(row)
+        nullCounts.append(counts)
+        if (i + 1) % 50 == 0:
+            print(str(i + 1) + ' SNPs permuted: ' + str(time.time() - startTime))
+    countCols = ['Null Count = ' + str(k) for k in range(len(outcomes) + 1)]
+    nullDF = pandas.DataFrame(numpy.reshape(nullCounts,(len(snps),len(countCols))),columns=countCols)
+    nullDF.insert(0,'SNP',list(snps))
+    nullDF.loc[len(nullDF)] = ['All SNPs'] + list(nullDF[countCols].sum(axis=0))
+    return pandas.DataFrame(results), nullDF
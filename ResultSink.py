@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+'''
+ResultSink
+
+Bounded-memory writer for large result tables. Rows arrive in column blocks
+and are held in fixed-size typed buffers. Unsorted tables are flushed to
+CSV (optionally gzip/bz2/xz compressed) or Parquet as the buffers fill.
+Sorted tables are spilled as sorted runs of .npy columns and merged into
+the output block by block when the sink is closed, so the sort holds
+about one buffer of rows whatever the table size.
+'''
+
+import os
+import bz2
+import gzip
+import lzma
+import shutil
+import tempfile
+import numpy
+import pandas
+
+try:
+    import pyarrow
+    from pyarrow import parquet
+except ImportError:
+    pyarrow = None
+
+csvOpeners = {'gzip':gzip.open,'bz2':bz2.open,'xz':lzma.open}
+csvSuffixes = {'gzip':'.gz','bz2':'.bz2','xz':'.xz'}
+
+def outputPath(outputName,fileFormat='csv',compression=None):
+    # 'name Report' -> 'name Report.csv', 'name Report.csv.gz', 'name Report.parquet'
+    if fileFormat == 'parquet':
+        return outputName + '.parquet'
+    return outputName + '.csv' + csvSuffixes.get(compression,'')
+
+class TableWriter(object):
+    # appends DataFrame blocks to one CSV or Parquet file
+    def __init__(self,path,fileFormat='csv',compression=None):
+        self.path = path
+        self.fileFormat = fileFormat
+        self.compression = compression
+        self.handle = None
+        self.writer = None
+        if fileFormat == 'parquet':
+            if pyarrow is None:
+                raise ValueError('Parquet output needs pyarrow installed.')
+        elif compression is not None and compression not in csvOpeners:
+            raise ValueError('Unknown CSV compression: ' + str(compression))
+
+    def write(self,block):
+        if self.fileFormat == 'parquet':
+            table = pyarrow.Table.from_pandas(block,preserve_index=False)
+            if self.writer is None:
+                self.writer = parquet.ParquetWriter(self.path,table.schema,compression=self.compression or 'snappy')
+            self.writer.write_table(table)
+            return
+        header = self.handle is None
+        if header:
+            opener = csvOpeners.get(self.compression,open)
+            self.handle = opener(self.path,'wt',newline='')
+        block.to_csv(self.handle,index=False,header=header,sep=',')
+
+    def close(self,columns=None):
+        if self.handle is None and self.writer is None and columns is not None:
+            self.write(pandas.DataFrame({name:numpy.zeros(0,dtype=dtype) for name, dtype in columns.items()}))
+        if self.writer is not None:
+            self.writer.close()
+        if self.handle is not None:
+            self.handle.close()
+        self.handle = None
+        self.writer = None
+
+def sortKeys(values,ascending):
+    # float keys where NaN sorts last either way, as in DataFrame.sort_values
+    keys = numpy.asarray(values,dtype=float)
+    keys = keys if ascending else -keys
+    return numpy.where(numpy.isnan(keys),numpy.inf,keys)
+
+class ResultSink(object):
+    # columns: {name: dtype}, object for text. With sortBy, rows are written
+    # ordered on that column, ties kept in 'order' (insertion order by default).
+    def __init__(self,path,columns,sortBy=None,ascending=True,fileFormat='csv',compression=None,
+                 bufferRows=2**20,tmpDir=None):
+        self.columns = dict(columns)
+        self.sortBy = sortBy
+        self.ascending = ascending
+        self.bufferRows = bufferRows
+        self.writer = TableWriter(path,fileFormat,compression)
+        self.path = path
+        self.buffers = {name:numpy.empty(bufferRows,dtype=dtype) for name, dtype in self.columns.items()}
+        self.order = numpy.empty(bufferRows,dtype=numpy.int64)
+        self.filled = 0
+        self.appended = 0
+        self.rows = 0
+        self.runs = []
+        self.tmpDir = None
+        if sortBy is not None:
+            self.tmpDir = tempfile.mkdtemp(prefix='ResultSink',dir=tmpDir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        if exc[0] is not None:
+            self.discard()
+        else:
+            self.close()
+
+    def append(self,block,order=None):
+        # block: {name: array} of equal lengths covering every column
+        n = len(next(iter(block.values()))) if len(block) > 0 else 0
+        if order is None:
+            order = numpy.arange(self.appended,self.appended+n)
+        order = numpy.asarray(order,dtype=numpy.int64)
+        self.appended += n
+        done = 0
+        while done < n:
+            take = min(n - done,self.bufferRows - self.filled)
+            for name in self.columns:
+                self.buffers[name][self.filled:self.filled+take] = numpy.asarray(block[name])[done:done+take]
+            self.order[self.filled:self.filled+take] = order[done:done+take]
+            self.filled += take
+            done += take
+            if self.filled == self.bufferRows:
+                self.flush()
+
+    def flush(self):
+        if self.filled == 0:
+            return
+        block = {name:self.buffers[name][:self.filled] for name in self.columns}
+        if self.sortBy is None:
+            self.writer.write(pandas.DataFrame(block,columns=list(self.columns)))
+            self.rows += self.filled
+        else:
+            self.spill(block,self.order[:self.filled])
+        self.filled = 0
+
+    def spill(self,block,order):
+        # one sorted run, a .npy file per column so the merge can seek into it
+        keys = sortKeys(block[self.sortBy],self.ascending)
+        index = numpy.lexsort((order,keys))
+        runDir = os.path.join(self.tmpDir,str(len(self.runs)))
+        os.makedirs(runDir)
+        run = {'_key':keys[index],'_order':order[index]}
+        for name in self.columns:
+            column = block[name][index]
+            run[name] = column.astype(str) if column.dtype == object else column
+        for k, column in enumerate(run.values()):
+            numpy.save(os.path.join(runDir,str(k) + '.npy'),column)
+        self.runs.append((runDir,list(run)))
+
+    def openRun(self,run):
+        # {name: (file, dtype, data offset, rows)}; blocks are read with seeks,
+        # not memory maps, so pages already merged are not kept resident
+        runDir, names = run
+        columns = {}
+        for k in range(len(names)):
+            f = open(os.path.join(runDir,str(k) + '.npy'),'rb')
+            version = numpy.lib.format.read_magic(f)
+            readHeader = numpy.lib.format.read_array_header_1_0 if version == (1,0) else numpy.lib.format.read_array_header_2_0
+            shape, fortranOrder, dtype = readHeader(f)
+            columns[names[k]] = (f,dtype,f.tell(),shape[0])
+        return columns
+
+    def readRun(self,columns,start,stop):
+        chunk = {}
+        for name, (f, dtype, offset, rows) in columns.items():
+            f.seek(offset + start*dtype.itemsize)
+            chunk[name] = numpy.fromfile(f,dtype=dtype,count=stop-start)
+        return chunk
+
+    def merge(self,blockRows):
+        # k-way merge: rows up to the smallest last-loaded (key, order) of the
+        # unfinished runs are final, so only one block per run is in memory
+        runs = [self.openRun(run) for run in self.runs]
+        cursors = [0]*len(runs)
+        pending = [None]*len(runs)
+        lengths = [run['_key'][3] for run in runs]
+        def load(r):
+            stop = min(lengths[r],cursors[r] + blockRows)
+            chunk = self.readRun(runs[r],cursors[r],stop)
+            cursors[r] = stop
+            pending[r] = chunk if pending[r] is None else {name:numpy.concatenate([pending[r][name],chunk[name]]) for name in chunk}
+        for r in range(len(runs)):
+            load(r)
+        while True:
+            live = [r for r in range(len(runs)) if cursors[r] < lengths[r]]
+            if len(live) > 0:
+                last = min(live,key=lambda r: (pending[r]['_key'][-1],pending[r]['_order'][-1]))
+                limit = (pending[last]['_key'][-1],pending[last]['_order'][-1])
+            ready = []
+            for r in range(len(runs)):
+                keys, order = pending[r]['_key'], pending[r]['_order']
+                if len(live) > 0:
+                    n = int(numpy.count_nonzero((keys < limit[0]) | ((keys == limit[0]) & (order <= limit[1]))))
+                else:
+                    n = len(keys)
+                ready.append({name:column[:n] for name, column in pending[r].items()})
+                pending[r] = {name:column[n:] for name, column in pending[r].items()}
+            block = {name:numpy.concatenate([chunk[name] for chunk in ready]) for name in ready[0]}
+            if len(block['_key']) > 0:
+                index = numpy.lexsort((block['_order'],block['_key']))
+                self.writer.write(pandas.DataFrame({name:block[name][index] for name in self.columns},columns=list(self.columns)))
+                self.rows += len(index)
+            if len(live) == 0:
+                break
+            for r in live:
+                if len(pending[r]['_key']) == 0:
+                    load(r)
+        for run in runs:
+            for f, dtype, offset, rows in run.values():
+                f.close()
+
+    def close(self):
+        # returns the number of rows written
+        self.flush()
+        if self.sortBy is not None and len(self.runs) > 0:
+            #the merge holds about one buffer's worth of rows, however many runs there are
+            self.merge(max(1024,self.bufferRows // len(self.runs)))
+        self.writer.close(self.columns)
+        self.cleanUp()
+        return self.rows
+
+    def discard(self):
+        self.writer.close()
+        self.cleanUp()
+
+    def cleanUp(self):
+        if self.tmpDir is not None:
+            shutil.rmtree(self.tmpDir,ignore_errors=True)
+            self.tmpDir = None
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+'''
+SNPCache
+
+On-disk cache of parsed workbooks. Entries are keyed on the input's path,
+size, mtime and content hash plus the reader options, are dropped when the
+input changes, and are evicted least-recently-used past a size limit.
+Frames are stored as Feather when pyarrow is installed, pickle otherwise.
+'''
+
+import os
+import json
+import time
+import hashlib
+import threading
+import pandas
+
+try:
+    import pyarrow
+    from pyarrow import feather
+except ImportError:
+    pyarrow = None
+
+defaultCacheDir = os.path.join(os.path.expanduser('~'),'.cache','SNPScanner')
+defaultMaxBytes = 10 * 2**30
+
+def fileHash(path,blockSize=2**22):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path,'rb') as f:
+        block = f.read(blockSize)
+        while block:
+            digest.update(block)
+            block = f.read(blockSize)
+    return digest.hexdigest()
+
+class DataCache(object):
+    def __init__(self,cacheDir=defaultCacheDir,maxBytes=defaultMaxBytes):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.indexPath = os.path.join(cacheDir,'index.json')
+        os.makedirs(cacheDir,exist_ok=True)
+
+    def readIndex(self):
+        try:
+            with open(self.indexPath,'r') as f:
+                return json.load(f)
+        except (IOError,ValueError):
+            return {}
+
+    def writeIndex(self,index):
+        #shard processes, and SourceLoader threads within one, may share the cache
+        tmpPath = self.indexPath + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+        with open(tmpPath,'w') as f:
+            json.dump(index,f,indent=1)
+        os.replace(tmpPath,self.indexPath)
+
+    def dropEntry(self,index,key):
+        entry = index.pop(key,None)
+        if entry is not None:
+            try:
+                os.remove(os.path.join(self.cacheDir,entry['file']))
+            except OSError:
+                pass
+
+    def lookup(self,index,path,options):
+        # cheap stat match first; hash the file only when the stat is unknown or changed
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        for key, entry in index.items():
+            if all([entry['path'] == path, entry['size'] == stat.st_size,
+                    entry['mtime'] == stat.st_mtime, entry['options'] == options]):
+                return key, None
+        contentHash = fileHash(path)
+        for key, entry in list(index.items()):
+            if all([entry['hash'] == contentHash, entry['size'] == stat.st_size, entry['options'] == options]):
+                entry.update({'path':path,'mtime':stat.st_mtime})
+                return key, contentHash
+            if entry['path'] == path and entry['options'] == options:
+                self.dropEntry(index,key)#input changed since it was cached
+        return None, contentHash
+
+    def knownHash(self,path):
+        # content hash of path from an entry whose stat still matches, None when there is none
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        for entry in self.readIndex().values():
+            if entry['path'] == path and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                return entry['hash']
+        return None
+
+    def readFrame(self,entry):
+        fullPath = os.path.join(self.cacheDir,entry['file'])
+        if entry['format'] == 'feather':
+            return pandas.read_feather(fullPath)
+        return pandas.read_pickle(fullPath)
+
+    def writeFrame(self,data,key):
+        if pyarrow is not None and all(isinstance(c,str) for c in data.columns):
+            fileName = key + '.feather'
+            try:
+                feather.write_feather(data.reset_index(drop=True),os.path.join(self.cacheDir,fileName),compression='lz4')
+                return fileName, 'feather'
+            except (pyarrow.ArrowException,TypeError,ValueError):
+                pass#mixed-type columns; fall back to pickle
+        fileName = key + '.pkl'
+        data.to_pickle(os.path.join(self.cacheDir,fileName))
+        return fileName, 'pickle'
+
+    def evict(self,index,keep=None):
+        total = sum(entry['bytes'] for entry in index.values())
+        for key in sorted(index.keys(),key=lambda k: index[k]['lastUsed']):
+            if total <= self.maxBytes:
+                break
+            if key == keep:
+                continue
+            total -= index[key]['bytes']
+            self.dropEntry(index,key)
+
+    def load(self,path,options,reader):
+        # reader() parses path on a miss
+        index = self.readIndex()
+        key, contentHash = self.lookup(index,path,options)
+        if key is not None:
+            try:
+                data = self.readFrame(index[key])
+                index[key]['lastUsed'] = time.time()
+                self.writeIndex(index)
+                return data
+            except (IOError,OSError,ValueError):
+                self.dropEntry(index,key)
+                if contentHash is None:
+                    contentHash = fileHash(path)#the stat matched, so lookup did not hash the file
+        data = reader()
+        stat = os.stat(path)
+        key = hashlib.blake2b((contentHash + json.dumps(options,sort_keys=True)).encode(),digest_size=16).hexdigest()
+        fileName, fileFormat = self.writeFrame(data,key)
+        #other loads may have added entries while reader() ran; entries whose file was dropped stay out
+        index = {k:e for k, e in self.readIndex().items() if os.path.exists(os.path.join(self.cacheDir,e['file']))}
+        index[key] = {'path':os.path.abspath(path),
+                      'size':stat.st_size,
+                      'mtime':stat.st_mtime,
+                      'hash':contentHash,
+                      'options':options,
+                      'file':fileName,
+                      'format':fileFormat,
+                      'bytes':os.path.getsize(os.path.join(self.cacheDir,fileName)),
+                      'lastUsed':time.time()}
+        self.evict(index,keep=key)
+        self.writeIndex(index)
+        return data
+
+    def clear(self):
+        index = self.readIndex()
+        for key in list(index.keys()):
+            self.dropEntry(index,key)
+        self.writeIndex(index)
@@ -1,146 +1,209 @@
-# -*- coding: utf-8 -*-
-'''
-#SNPControlCheck
-
-@author: Fayten El-Dehaibi
-Created on 27 Nov 2018
-'''
-
-import sys
-import os
-import xlsxwriter
-import numpy
-import pandas
-import scipy
-from scipy import stats, optimize
-import time
-import re
-from itertools import compress
-import random
-
-print('Reading...')
-startTime = time.time()
-data_ = pandas.read_csv('C:/Users/Monster Workstation/Documents/Gargantuan Genome Dataset/Pitt Metabolomics+Sc2i.csv',
-                        engine='python', header=0, iterator=True, chunksize=15000,skipinitialspace=True)
-data = pandas.concat(data_,ignore_index=True)
-countTable_ = pandas.read_csv('C:/Users/Monster Workstation/Documents/vodovotz-database-query/SNPScanner/All Data Fixed Table.csv',
-                              engine='python', header=0, iterator=True, chunksize=15000,skipinitialspace=True)
-countTable = pandas.concat(countTable_,ignore_index=True)
-goodPats_ = pandas.read_csv('C:/Users/Monster Workstation/Documents/vodovotz-database-query/SNPScanner Original Pool.csv',
-                            engine='python', header=0, iterator=True, chunksize=15000,skipinitialspace=True)
-goodPats = pandas.concat(goodPats_,ignore_index=True)
-print('Read!')
-
-outputTitle = 'Even ControlSNP Randomized Clinical Analysis--correct.xlsx'
-
-#pull index of 0 cyt snps from data.Names
-lastIndex = countTable[countTable['Number Significant Mediators']==1].index[0]
-snpNames = list(countTable.loc[:lastIndex,'SNP Name'])
-controlIndex = [data[data.Name==n].index[0] for n in snpNames] #DO NOT SORT THIS LIST!
-#KEEP LIST OF CONTROLSNPINDEX
-
-#screen for proper patient columns
-blanks = []
-checkForBlanks = pandas.DataFrame(pandas.isnull(data.iloc[controlIndex,12:]))
-checkForBlanksList = list(checkForBlanks.all())
-for x in range(len(list(checkForBlanks.columns))):
-            if checkForBlanksList[x]:
-                blanks.append(list(checkForBlanks.columns)[x])
-data = data.drop(blanks,axis='columns')
-timeIndices = data[data['patient_id'].map(lambda x: x == 'time')].index
-preCytokinesCols = list(set(data.loc[timeIndices[0]:controlIndex[0], list(data.columns)[0]].dropna(axis=0)))
-cytokinesCols = [c for c in preCytokinesCols if(str(c) == 'time' or str(c).startswith('plasma_2_'))]
-cyts = [cyt for cyt in cytokinesCols if cyt != 'time']
-cytokineIndices = {}
-for cyt in range(len(cytokinesCols)):
-    cytokineIndices[cytokinesCols[cyt]] = list(data[data['patient_id'].map(lambda x: x == cytokinesCols[cyt])].index)
-cytIndVals =[*cytokineIndices.values()]
-deathRow = data[data.patient_id == 'discharge_discharged_to']
-deathRow = deathRow[deathRow.isin(['Death'])]
-deathRow = deathRow.dropna(axis='columns', how='all')
-deadPats = list(deathRow.columns)
-survivors = [c for c in list(data.columns)[12:] if c not in deadPats]
-#survivors = [c for c in list(goodPats.columns)[4:]] #Used for original 380 patient cohort only
-goodCols = ['patient_id','Name'] + survivors
-data = data.loc[:,goodCols]
-
-#don't need to run checkAA/checkBB, because these SNPs are already screened for equivalent distribution
-#reduce total data index to ICULOS,total LOS, vent, and MODS + controlIndex
-params = ['discharge_total_icu_days','discharge_total_hospital_days','discharge_total_ventilator_days',
-         'MOD1','MOD2','MOD3','MOD4','MOD5','MOD6','MOD7']
-paramIndex = [data[data.patient_id==p].index[0] for p in params]
-dataIndex = paramIndex + controlIndex
-data = data.iloc[dataIndex,:]
-print('DataFrame reduced')
-#KEEP LIST OF PARAMETERINDEX
-paramCols = ['ICU','TotalLOS','Vent','MOD1','MOD2','MOD3','MOD4','MOD5','MOD6','MOD7']
-patientsDF = pandas.DataFrame(columns=paramCols)
-patientSeries_ = []
-for s in survivors:
-    patientSeries = pandas.Series({'ID':s,
-                                   'ICU':data.loc[paramIndex[0],s],
-                                   'TotalLOS':data.loc[paramIndex[1],s],
-                                   'Vent':data.loc[paramIndex[2],s],
-                                   'MOD1':data.loc[paramIndex[3],s],
-                                   'MOD2':data.loc[paramIndex[4],s],
-                                   'MOD3':data.loc[paramIndex[5],s],
-                                   'MOD4':data.loc[paramIndex[6],s],
-                                   'MOD5':data.loc[paramIndex[7],s],
-                                   'MOD6':data.loc[paramIndex[8],s],
-                                   'MOD7':data.loc[paramIndex[9],s]})
-    patientSeries_.append(patientSeries)
-patientsDF = pandas.concat(patientSeries_,axis=1)
-patientsDF.columns = patientsDF.iloc[0,:]
-patientsDF = patientsDF.drop(patientsDF.index[0],axis='index')
-#NOW do checkAA/checkBB to get patientAA/BB {name:[<columnList>]}
-checkAA = data.isin(['AA'])
-checkBB = data.isin(['BB'])
-SNPsAndPatientsAA = {}
-SNPsAndPatientsBB = {}
-for ctlIndex,SNPname in zip(controlIndex,snpNames):
-    lineAA = checkAA.loc[ctlIndex,:][checkAA.loc[ctlIndex,:]]
-    lineBB = checkBB.loc[ctlIndex,:][checkBB.loc[ctlIndex,:]]
-    SNPsAndPatientsAA[SNPname] = list(lineAA.index)
-    SNPsAndPatientsBB[SNPname] = list(lineBB.index)
-overallResults = []
-shortResults = []
-startTime2 = time.time()
-results = []
-for snp in snpNames:
-    dataDFs = [pandas.DataFrame(),pandas.DataFrame()]
-    dataDicts = [SNPsAndPatientsAA,SNPsAndPatientsBB]
-    for gtype in range(2):
-        theseCols = dataDicts[gtype][snp] #list of columns
-        dataDFs[gtype] = patientsDF.loc[:,theseCols].T
-    dataDFAA = dataDFs[0]
-    dataDFBB = dataDFs[1]
-    mwu0,pICU = scipy.stats.mannwhitneyu(pandas.Series(dataDFAA['ICU'],dtype=float).dropna(),
-                                         pandas.Series(dataDFBB['ICU'],dtype=float).dropna(),alternative='two-sided')
-    mwu1,pLOS = scipy.stats.mannwhitneyu(pandas.Series(dataDFAA['TotalLOS'],dtype=float).dropna(),
-                                         pandas.Series(dataDFBB['TotalLOS'],dtype=float).dropna(),alternative='two-sided')
-    mwu2,pVent = scipy.stats.mannwhitneyu(pandas.Series(dataDFAA['Vent'],dtype=float).dropna(),
-                                          pandas.Series(dataDFBB['Vent'],dtype=float).dropna(),alternative='two-sided')
-    # v This fixes MODS
-    modSeriesAA = pandas.Series(pandas.concat([dataDFAA['MOD1'],dataDFAA['MOD2'],dataDFAA['MOD3'],
-                                 dataDFAA['MOD4'],dataDFAA['MOD5'],dataDFAA['MOD6'],
-                                 dataDFAA['MOD7']],axis=0),dtype=float).dropna()
-    modSeriesBB = pandas.Series(pandas.concat([dataDFBB['MOD1'],dataDFBB['MOD2'],dataDFBB['MOD3'],
-                                 dataDFBB['MOD4'],dataDFBB['MOD5'],dataDFBB['MOD6'],
-                                 dataDFBB['MOD7']],axis=0),dtype=float).dropna()
-    mwu3,pMODS = scipy.stats.mannwhitneyu(modSeriesAA,modSeriesBB,alternative='two-sided')
-    results.append(pandas.Series({'SNP':snp,
-                                       'ICU pVal':pICU,
-                                       'TotalLOS pVal':pLOS,
-                                       'Vent pVal':pVent,
-                                       'MODS pVal':pMODS}))
-batchResultDF = pandas.concat(results,axis=1,ignore_index=True).T
-batchResultDF['Significance Count'] = batchResultDF.iloc[:,1:].lt(0.05,axis=0).sum(axis=1)
-overallResults.append(batchResultDF)
-finalResults = pandas.concat(overallResults,ignore_index=True)
-print(finalResults.loc[:,'Significance Count'].value_counts())
-
-writer =  pandas.ExcelWriter(outputTitle, engine='xlsxwriter')
-finalResults.to_excel(writer,'Control SNP Batch MWU',index=False)
-writer.close()
-print(time.time()-startTime)
-print('Done!')
\ No newline at end of file
+# -*- coding: utf-8 -*-
+'''
+#SNPControlCheck
+
+@author: Fayten El-Dehaibi
+Created on 27 Nov 2018
+
+Clinical-outcome check of control SNPs: the SNPs a scan found (almost) no
+significant mediators for are tested, AA against BB, on ICU days, total
+hospital days, ventilator days and pooled MODS scores, with an optional
+permutation null. The outcome rows are held as one float matrix, ranked
+once per outcome, and every control SNP is tested in batches. The data
+sheet, the scan Table and the optional cohort file are read together by
+SourceLoader, keeping only the patient columns and the outcome and control
+SNP rows of the sheet.
+Run "python SNPControlCheck.py <data.csv> <scan Table.csv> -o <output.xlsx>",
+or call run() from another pipeline.
+'''
+
+import sys
+import argparse
+import numpy
+import pandas
+
+import BatchMWU
+import Instrument
+import PermutationNull
+import SNPCache
+import SourceLoader
+from GenotypeStore import GenotypeStore, AA, BB
+
+nMetaCols = 12
+nCohortMetaCols = 4 #the Original Pool sheet: four metadata columns, then one per patient
+dataColumns = ['patient_id','Name']
+tableColumns = ['SNP Name','Number Significant Mediators']
+defaultDataPath = 'C:/Users/Monster Workstation/Documents/Gargantuan Genome Dataset/Pitt Metabolomics+Sc2i.csv'
+defaultTablePath = 'C:/Users/Monster Workstation/Documents/vodovotz-database-query/SNPScanner/All Data Fixed Table.csv'
+outputTitle = 'Even ControlSNP Randomized Clinical Analysis--correct.xlsx'
+nPermutations = 10000 #AA/BB label shuffles per control SNP; 0 skips the empirical null
+permutationSeed = 20181127
+#outcome -> the patient_id rows pooled into it; MODS has one observation per MOD day
+defaultOutcomes = {'ICU':['discharge_total_icu_days'],
+                   'TotalLOS':['discharge_total_hospital_days'],
+                   'Vent':['discharge_total_ventilator_days'],
+                   'MODS':['MOD1','MOD2','MOD3','MOD4','MOD5','MOD6','MOD7']}
+
+def controlSNPs(countTable,maxMediators=0):
+    # scan Table SNPs with at most maxMediators significant mediators, in Table order
+    keep = pandas.to_numeric(countTable['Number Significant Mediators']) <= maxMediators
+    return list(countTable.loc[keep,'SNP Name'])
+
+def firstRows(data,column,names):
+    # index of the first row whose column equals each name
+    labels = data[column]
+    labels = labels[labels.notnull() & ~labels.duplicated()]
+    rows = pandas.Series(labels.index,index=labels.to_numpy()).reindex(names)
+    if rows.isnull().any():
+        missing = [str(n) for n in rows[rows.isnull()].index]
+        raise ValueError('Not found in ' + column + ': ' + ', '.join(missing[:10]) + (' ...' if len(missing) > 10 else ''))
+    return list(rows.astype(numpy.int64))
+
+def survivingPatients(data,snpRows,patients):
+    # patients genotyped for at least one of the SNPs and not discharged to death
+    genotyped = data.loc[snpRows,patients].notnull().any(axis=0)
+    died = (data.loc[data['patient_id'] == 'discharge_discharged_to',patients] == 'Death').any(axis=0)
+    return [p for p in patients if genotyped[p] and not died[p]]
+
+def outcomeMatrix(data,patients,rows):
+    # rows x patients floats of the given patient_id rows; text that is not a number is NaN
+    values = data.loc[firstRows(data,'patient_id',rows),patients].to_numpy(dtype=object)
+    numbers = pandas.to_numeric(pandas.Series(values.ravel()),errors='coerce').to_numpy(dtype=float)
+    return numbers.reshape(values.shape)
+
+def rankOutcomes(matrix,rows,outcomes):
+    # BatchMWU.rankObservations per outcome, pooling its rows; owners are matrix columns
+    rankedList = []
+    for outcomeRows in outcomes.values():
+        values = matrix[[rows.index(r) for r in outcomeRows]]
+        owners = numpy.tile(numpy.arange(matrix.shape[1]),(len(outcomeRows),1))
+        rankedList.append(BatchMWU.rankObservations(values.ravel(),owners.ravel()))
+    return rankedList
+
+def testOutcomes(rankedList,outcomes,store,alpha=0.05,blockSize=4096):
+    # AA vs BB p-value of every store SNP on every outcome, a block of SNPs at a time
+    p = numpy.zeros((len(store),len(outcomes)))
+    for start in range(0,len(store),blockSize):
+        stop = min(len(store),start + blockSize)
+        calls = store.calls[start:stop]
+        for o in range(len(outcomes)):
+            p[start:stop,o] = BatchMWU.mannWhitneyRanked(rankedList[o],calls == AA,calls == BB)[1]
+    results = pandas.DataFrame({'SNP':store.snpNames})
+    for o in range(len(outcomes)):
+        results[outcomes[o] + ' pVal'] = p[:,o]
+    results['Significance Count'] = (p < alpha).sum(axis=1)
+    return results
+
+def writeResults(outputName,results,permResults=None,nullCounts=None):
+    writer =  pandas.ExcelWriter(outputName, engine='xlsxwriter')
+    results.to_excel(writer,sheet_name='Control SNP Batch MWU',index=False)
+    if permResults is not None:
+        permResults.to_excel(writer,sheet_name='Permutation pValues',index=False)
+        nullCounts.to_excel(writer,sheet_name='Null Significance Count',index=False)
+    writer.close()
+
+def outcomeRows(outcomes):
+    # patient_id rows of all outcomes, each once, in order
+    return list(dict.fromkeys(r for rows in outcomes.values() for r in rows))
+
+def controlSources(dataPath,tablePath,outcomes,maxMediators=0,maxSNPs=None,patientPath=None):
+    # SourceLoader sources: the Table's count columns, the cohort file's header, and the
+    # data sheet's patient columns (those in the cohort) of the outcome, discharge and control SNP rows;
+    # the sheet starts parsing at once and waits for the Table only to filter its first chunk
+    sources = {'table':SourceLoader.Source(tablePath,columns=tableColumns,skipinitialspace=True)}
+    if patientPath is not None:
+        sources['cohort'] = SourceLoader.Source(patientPath,columns=lambda header, loaded: header[nCohortMetaCols:],nrows=0,
+                                                skipinitialspace=True)
+    def columns(header,loaded):
+        patients = header[nMetaCols:]
+        if 'cohort' in loaded:
+            cohort = set(loaded['cohort'].columns)
+            patients = [p for p in patients if p in cohort]
+        return dataColumns + patients
+    sources['data'] = SourceLoader.Source(dataPath,columns=columns,
+                                          rows={'patient_id':outcomeRows(outcomes) + ['discharge_discharged_to'],
+                                                'Name':lambda loaded: controlSNPs(loaded['table'],maxMediators)[:maxSNPs]},
+                                          needs=['table'] + (['cohort'] if patientPath is not None else []),
+                                          skipinitialspace=True)
+    return sources
+
+def run(dataPath,tablePath,outputName=outputTitle,outcomes=None,maxMediators=0,nPermutations=nPermutations,
+        seed=permutationSeed,patientPath=None,trace=None,maxSNPs=None,cache=None):
+    # outcomes: {name: [patient_id rows]}, defaultOutcomes when None; nPermutations 0 skips the null;
+    # patientPath: cohort file whose patient columns restrict the analysis; maxSNPs keeps only
+    # the first control SNPs of the Table; cache: SNPCache.DataCache for the projected inputs.
+    # returns the outcome p-values and, with permutations, their permutation p-values and null counts
+    outcomes = defaultOutcomes if outcomes is None else outcomes
+    trace = Instrument.Trace() if trace is None else trace
+    with trace.stage('read'):
+        frames = SourceLoader.loadSources(controlSources(dataPath,tablePath,outcomes,maxMediators,maxSNPs,patientPath),cache=cache)
+        data, countTable = frames['data'], frames['table']
+    trace.count('data rows kept',len(data))
+    with trace.stage('reduce'):
+        snps = controlSNPs(countTable,maxMediators)[:maxSNPs]
+        snpRows = firstRows(data,'Name',snps)
+        patients = survivingPatients(data,snpRows,list(data.columns)[len(dataColumns):])
+        store = GenotypeStore.fromFrame(data,snpRows,patients)
+        rows = outcomeRows(outcomes)
+        rankedList = rankOutcomes(outcomeMatrix(data,patients,rows),rows,outcomes)
+    trace.count('control SNPs',len(snps))
+    with trace.stage('test'):
+        results = testOutcomes(rankedList,list(outcomes),store)
+    tested = results[[name + ' pVal' for name in outcomes]].notnull().to_numpy()
+    trace.count('tests run',tested.size)
+    trace.count('tests skipped for empty groups',int((~tested).sum()))
+    print(results.loc[:,'Significance Count'].value_counts())
+    permResults, nullCounts = None, None
+    if nPermutations > 0:
+        #empirical null: batches of shuffled AA/BB labels per SNP against the same ranked outcomes
+        with trace.stage('permutation'):
+            permResults, nullCounts = PermutationNull.permutationNull(rankedList,list(outcomes),snps,store.mask(AA),store.mask(BB),
+                                                                      nPermutations,seed=seed)
+        trace.count('permutations run',int(permResults['Permutations'].sum()))
+        print(nullCounts.iloc[-1,:])
+    with trace.stage('write',cancellable=False):
+        writeResults(outputName,results,permResults,nullCounts)
+    trace.count('rows written',len(results) + (0 if permResults is None else len(permResults) + len(nullCounts)))
+    return results, permResults, nullCounts
+
+def parseOutcome(text):
+    # 'MODS=MOD1,MOD2,...' -> ('MODS', ['MOD1', 'MOD2', ...])
+    name, rows = text.split('=',1)
+    return name, [r for r in rows.split(',') if len(r) > 0]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Test control SNPs against clinical outcomes.')
+    parser.add_argument('data',nargs='?',default=defaultDataPath,help='cohort CSV the scan was run on')
+    parser.add_argument('table',nargs='?',default=defaultTablePath,help='the scan\'s "<output> Table.csv"')
+    parser.add_argument('-o','--output',default=outputTitle,help='Excel workbook to write')
+    parser.add_argument('--max-mediators',type=int,default=0,help='control SNPs have at most this many significant mediators')
+    parser.add_argument('--max-snps',type=int,default=None,help='test only the first this many control SNPs of the Table')
+    parser.add_argument('--outcome',action='append',type=parseOutcome,metavar='NAME=ROW[,ROW...]',
+                        help='outcome and the patient_id rows pooled into it; repeat for each (default: ICU, TotalLOS, Vent, MODS)')
+    parser.add_argument('--permutations',type=int,default=nPermutations,help='AA/BB label shuffles per control SNP; 0 skips the null')
+    parser.add_argument('--seed',type=int,default=permutationSeed)
+    parser.add_argument('--patients',default=None,metavar='FILE',
+                        help='cohort CSV (e.g. the Original Pool sheet) whose patient columns, after the first four, restrict the analysis')
+    parser.add_argument('--no-cache',action='store_true',help='always re-parse the input files')
+    parser.add_argument('--trace',default=None,metavar='FILE',help='write stage times, memory and counters to FILE (.json, or .csv)')
+    parser.add_argument('--profile',default=None,metavar='STAGE',help='run STAGE (read, reduce, test, permutation) under cProfile')
+    args = parser.parse_args(argv)
+    outcomes = None if args.outcome is None else dict(args.outcome)
+    trace = Instrument.Trace(profile=args.profile)
+    cache = None if args.no_cache else SNPCache.DataCache()
+    try:
+        run(args.data,args.table,args.output,outcomes,args.max_mediators,args.permutations,args.seed,args.patients,trace,args.max_snps,
+            cache)
+    except ValueError as e:
+        print('Error: ' + str(e))
+        return 1
+    print(trace.report())
+    if args.trace is not None:
+        trace.write(args.trace)
+    elif args.profile in trace.profiles:
+        print(trace.profileText(args.profile))
+    print('Done!')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
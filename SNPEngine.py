@@ -0,0 +1,656 @@
+# -*- coding: utf-8 -*-
+'''
+SNPEngine
+
+Headless read -> reduce -> screen -> test pipeline behind SNP Scanner.
+Run "python SNPEngine.py scan <file> -o <name>" to scan without a display;
+Qt and matplotlib are only imported by the dialogs and by --plot.
+'''
+
+import sys
+import argparse
+import collections
+import fractions
+import numpy
+import pandas
+import time
+import re
+
+import BatchMWU
+import Checkpoint
+import Instrument
+import ResultSink
+import ScanState
+import SNPCache
+import SNPReader
+from GenotypeStore import GenotypeStore, AA, BB
+
+nMetaCols = 12
+badCharRegex = re.compile(r'[<>*%]')
+
+def cleanTimes(times):
+    # 'h6' -> '06h', '24hr' -> '24h'
+    times = times.astype(object).where(times.notnull())
+    text = times.astype(str)
+    hasH = times.notnull() & text.str.contains('h',regex=False)
+    text = text.where(~(hasH & text.str.startswith('h')),text.str[1:] + 'h')
+    text = text.where(~hasH,text.str.replace('r','',regex=False))
+    text = text.where(~(hasH & (text.str.len() < 3)),'0' + text)
+    return text.where(times.notnull())
+
+def cleanValues(values):
+    # '<1.2', '>500', '35*' -> float
+    text = values.astype(str).str.replace(badCharRegex,'',regex=True)
+    return pandas.to_numeric(text,errors='coerce')
+
+def buildCytokineTable(data,cytokineIndices,patients):
+    # one row per (patient, time, mediator) observation with a float value;
+    # the x-th row of every mediator belongs to the x-th 'time' row
+    patients = list(patients)
+    cyts = [c for c in cytokineIndices.keys() if c != 'time']
+    timeRows = cytokineIndices['time']
+    nTimes = len(timeRows)
+    times = cleanTimes(pandas.Series(data.loc[timeRows,patients].to_numpy(dtype=object).ravel()))
+    times = times.to_numpy(dtype=object).reshape(nTimes,len(patients))
+    rows = [r for cyt in cyts for r in cytokineIndices[cyt][:nTimes]]
+    vals = data.loc[rows,patients].to_numpy(dtype=object).reshape(len(cyts),nTimes,len(patients))
+    present = pandas.notnull(vals)
+    cytIdx, timeIdx, patIdx = numpy.nonzero(present)
+    table = pandas.DataFrame({'patient':pandas.Categorical.from_codes(patIdx,categories=patients),
+                              'time':pandas.Categorical(times[timeIdx,patIdx]),
+                              'mediator':pandas.Categorical.from_codes(cytIdx,categories=cyts),
+                              'value':cleanValues(pandas.Series(vals[present],dtype=object)).to_numpy(dtype=float)})
+    return table[table['value'].notnull()].reset_index(drop=True)
+
+def mediatorObservations(cytTable):
+    # {mediator: (values, patient codes)} with patient codes indexing cytTable.patient's categories
+    observations = {}
+    codes = cytTable['mediator'].cat.codes.to_numpy()
+    order = numpy.argsort(codes,kind='stable')
+    values = cytTable['value'].to_numpy(dtype=float)[order]
+    owners = cytTable['patient'].cat.codes.to_numpy().astype(numpy.intp)[order]
+    bounds = numpy.searchsorted(codes[order],numpy.arange(len(cytTable['mediator'].cat.categories)+1))
+    for c, cyt in enumerate(cytTable['mediator'].cat.categories):
+        observations[cyt] = (values[bounds[c]:bounds[c+1]],owners[bounds[c]:bounds[c+1]])
+    return observations
+
+def findSNPBlock(data):
+    startSNPS = data[data.Chr.notnull()].index[0]
+    endSNPs = data[data.Normalization.notnull()].index[0]
+    return startSNPS, endSNPs
+
+def reductionPlan(header):
+    # header: the clinical/cytokine rows above the SNP block
+    blanks = []
+    checkForBlanks = pandas.DataFrame(pandas.isnull(header.iloc[:,nMetaCols:]))
+    checkForBlanksList = list(checkForBlanks.all())
+    for x in range(len(list(checkForBlanks.columns))):
+        if checkForBlanksList[x]:
+            blanks.append(list(checkForBlanks.columns)[x])
+    header = header.drop(blanks,axis='columns')
+    timeIndices = header[header['patient_id'].map(lambda x: x == 'time')].index
+    preCytokinesCols = sorted(set(header.loc[timeIndices[0]:, 'patient_id'].dropna(axis=0)))
+    cytokinesCols = [c for c in preCytokinesCols if(c == 'time' or c.startswith('plasma_2_'))]
+    cyts = [cyt for cyt in cytokinesCols if cyt != 'time']
+    cytokineIndices = {}
+    for cyt in range(len(cytokinesCols)):
+        cytokineIndices[cytokinesCols[cyt]] = list(header[header['patient_id'].map(lambda x: x == cytokinesCols[cyt])].index)
+    cytIndVals =[*cytokineIndices.values()]
+    allRows = [val for cyt in cytIndVals for val in cyt]
+    deathRow = header[header.patient_id == 'discharge_discharged_to']
+    deathRow = deathRow[deathRow.isin(['Death'])]
+    deathRow = deathRow.dropna(axis='columns', how='all')
+    deadPats = list(deathRow.columns)
+    deadPats_ = [c for c in list(header.columns) if c not in deadPats]
+    #deadPats_ = list(header.columns[:12]) + deadPats  # for nonsurvivor runs
+    #deadPats_ = list(header.columns[:12]) + ['HR-056','HR-341','HR-423','HR-426','HR-454','HR-1005','HR-1139','HR-1194','HR-1283',
+    #                                         'HR-198','HR-224','HR-260']  # for survivor matched run #HR-1261?
+    return header.loc[allRows,deadPats_], cyts, cytokineIndices
+
+def reduceData(data):
+    startSNPS, endSNPs = findSNPBlock(data)
+    print(str(endSNPs - startSNPS) + ' SNPs')
+    header, cyts, cytokineIndices = reductionPlan(data.loc[:startSNPS-1,:])
+    store = GenotypeStore.fromFrame(data,range(startSNPS,endSNPs),list(header.columns)[nMetaCols:])
+    return header, store, cyts, cytokineIndices
+
+def streamReduce(path,chunksize=15000,screen=None,trace=None,sheet='Sheet1',cell='A1',lastRow=None):
+    # Reads a CSV or .xlsx sheet in chunks: keeps the header rows as a frame and
+    # only screen-passing SNP rows, int8-encoded, so memory is set by chunksize.
+    # Only the first row of each SNP name is screened, as snpIndex would pick it
+    # from the whole sheet. lastRow stops reading after that sheet row.
+    header = []
+    plan = None
+    blocks = []
+    nSNPs = 0
+    seen = set()
+    for chunk in SNPReader.iterChunks(path,sheet,cell,chunksize):
+        if plan is None:
+            isSNP = chunk['Chr'].notnull().to_numpy()
+            if not isSNP.any():
+                header.append(chunk)
+                continue
+            first = numpy.argmax(isSNP)
+            header.append(chunk.iloc[:first])
+            plan = reductionPlan(pandas.concat(header))
+            header = None
+            patients = list(plan[0].columns)[nMetaCols:]
+            chunk = chunk.iloc[first:]
+        isNorm = chunk['Normalization'].notnull().to_numpy()
+        done = isNorm.any()
+        if done:
+            chunk = chunk.iloc[:numpy.argmax(isNorm)]
+        if lastRow is not None and len(chunk) > 0 and chunk.index[-1] >= lastRow:
+            chunk = chunk.loc[:lastRow]
+            done = True
+        block = GenotypeStore.fromFrame(chunk,chunk.index,patients)
+        nSNPs += len(block)
+        first = block.firstRows() & numpy.array([name not in seen for name in block.snpNames],dtype=bool)
+        seen.update(block.snpNames)
+        block = block.take(first)
+        if screen is not None:
+            block = block.take(screen(block))
+        blocks.append(block)
+        if done:
+            break
+    if plan is None:
+        raise ValueError('No SNP block (rows with Chr) found in ' + path)
+    print(str(nSNPs) + ' SNPs')
+    if trace is not None:
+        trace.count('SNPs screened',nSNPs)
+    data, cyts, cytokineIndices = plan
+    return data, GenotypeStore.concat(blocks,patients), cyts, cytokineIndices
+
+class Scenario(object):
+    # genotype-frequency screen: more than minCount AA and BB patients, and a BB
+    # frequency of ratioLow to ratioHigh times the AA frequency (or, eitherWay,
+    # an AA frequency of ratioLow to ratioHigh times the BB frequency); both ends inclusive
+    def __init__(self,minCount=20,ratioLow=0.9,ratioHigh=1.1,eitherWay=False):
+        self.minCount = minCount
+        self.ratioLow = ratioLow
+        self.ratioHigh = ratioHigh
+        self.eitherWay = eitherWay
+
+    def mask(self,counts):
+        # counts: GenotypeStore.counts()
+        # frequencies share the called count, so the ratios are compared on the integer counts
+        # against exact fractions (0.9 -> 9/10): a boundary SNP such as 30 AA, 27 BB always
+        # passes, where float frequencies let rounding decide it by the called count
+        nAA, nAB, nBB, totalCount = counts
+        low = fractions.Fraction(str(self.ratioLow))
+        high = fractions.Fraction(str(self.ratioHigh))
+        def within(n,m):
+            # low <= m/n <= high
+            return (n*low.numerator <= m*low.denominator) & (n*high.numerator >= m*high.denominator)
+        inRange = within(nAA,nBB)
+        if self.eitherWay:
+            inRange |= within(nBB,nAA)
+        return (nAA > self.minCount) & (nBB > self.minCount) & inRange
+
+scenarios = collections.OrderedDict([('equal',Scenario()),#equal distribution SNPs
+                                     ('rare',Scenario(20,0.05,0.1,eitherWay=True)),
+                                     ('rare nonsurvivors',Scenario(0,0.05,0.1,eitherWay=True))])#for nonsurvivor runs (see reductionPlan)
+
+def screenMask(store,minCount=20,ratioLow=0.9,ratioHigh=1.1):
+    return Scenario(minCount,ratioLow,ratioHigh).mask(store.counts())
+
+def checkScenarios(names):
+    unknown = [name for name in names if name not in scenarios]
+    if len(unknown) > 0:
+        raise ValueError('Unknown screening scenarios: ' + ', '.join(unknown) + ' (known: ' + ', '.join(scenarios) + ')')
+
+def screenScenarios(store,names):
+    # passing mask of each named scenario, from one count of the genotypes;
+    # only the first row of a SNP name can pass
+    checkScenarios(names)
+    counts = store.counts()
+    first = store.firstRows()
+    return collections.OrderedDict((name,scenarios[name].mask(counts) & first) for name in names)
+
+def scenarioSNPs(store,masks,goodSNPs):
+    # {scenario: its passing SNPs}, in goodSNPs order
+    groups = collections.OrderedDict()
+    for name, mask in masks.items():
+        passing = set(store.snpNames[i] for i in numpy.flatnonzero(mask))
+        groups[name] = [snp for snp in goodSNPs if snp in passing]
+    return groups
+
+def screenSNPs(store,passing=None):
+    # a SNP name on several rows is screened and tested on its first row, as
+    # snpIndex looks it up; its later rows never pass
+    if passing is None:
+        passing = screenMask(store)
+    SNPsAndPatientsAA = {}
+    SNPsAndPatientsBB = {}
+    goodSNPs = []
+    for i in numpy.flatnonzero(passing & store.firstRows()):
+        SNPname = store.snpNames[i]
+        line = store.calls[i,:]
+        goodSNPs.append(SNPname)
+        SNPsAndPatientsAA[SNPname] = [store.patients[j] for j in numpy.flatnonzero(line == AA)]
+        SNPsAndPatientsBB[SNPname] = [store.patients[j] for j in numpy.flatnonzero(line == BB)]
+    return goodSNPs, SNPsAndPatientsAA, SNPsAndPatientsBB
+
+def partitionMasks(snps,patients,patientsAA,patientsBB):
+    patIndex = {patients[j]:j for j in range(len(patients))}
+    maskAA = numpy.zeros((len(snps),len(patients)),dtype=bool)
+    maskBB = numpy.zeros((len(snps),len(patients)),dtype=bool)
+    for i in range(len(snps)):
+        maskAA[i,[patIndex[p] for p in patientsAA[snps[i]]]] = True
+        maskBB[i,[patIndex[p] for p in patientsBB[snps[i]]]] = True
+    return maskAA, maskBB
+
+def testMediators(rankedList,maskAA,maskBB,progress=None):
+    # U, p, nAA, nBB for every SNP (rows) x mediator (columns)
+    shape = (maskAA.shape[0],len(rankedList))
+    U, p = numpy.zeros(shape), numpy.zeros(shape)
+    nA, nB = numpy.zeros(shape,dtype=numpy.int64), numpy.zeros(shape,dtype=numpy.int64)
+    for c in range(len(rankedList)):
+        if progress is not None:
+            progress(c,len(rankedList))
+        U[:,c], p[:,c], nA[:,c], nB[:,c] = BatchMWU.mannWhitneyRanked(rankedList[c],maskAA,maskBB)
+    return U, p, nA, nB
+
+reportColumns = {'SNP':object,'Mediator':object,'p Value':numpy.float64,'Mann-Whitney U Score':numpy.float64,'ratio':object}
+
+def reportSink(outputName,fileFormat='csv',compression=None,bufferRows=2**20):
+    # ' Report' rows, written in descending p Value order when the sink is closed
+    path = ResultSink.outputPath(outputName+' Report',fileFormat,compression)
+    return ResultSink.ResultSink(path,reportColumns,sortBy='p Value',ascending=False,
+                                 fileFormat=fileFormat,compression=compression,bufferRows=bufferRows)
+
+class SplitSink(object):
+    # fans the Report rows of one test pass over snps out to a reportSink per
+    # group of them, '<outputName> <group> Report', each keeping the tie order
+    # it would have had if only its own SNPs were tested
+    def __init__(self,outputName,snps,groups,fileFormat='csv',compression=None):
+        position = {snps[i]:i for i in range(len(snps))}
+        self.nSNPs = len(snps)
+        self.places = {}
+        self.sizes = {}
+        self.sinks = collections.OrderedDict()
+        for name, members in groups.items():
+            place = numpy.full(len(snps),-1,dtype=numpy.int64)
+            place[[position[snp] for snp in members]] = numpy.arange(len(members))
+            self.places[name] = place
+            self.sizes[name] = len(members)
+            self.sinks[name] = reportSink(outputName + ' ' + name,fileFormat,compression)
+        self.path = collections.OrderedDict((name,sink.path) for name, sink in self.sinks.items())
+
+    def append(self,block,order):
+        # order: mediator*len(snps) + SNP position, as sortCytokineForSNP gives it
+        order = numpy.asarray(order,dtype=numpy.int64)
+        mediator, snp = order // max(1,self.nSNPs), order % max(1,self.nSNPs)
+        for name, sink in self.sinks.items():
+            place = self.places[name][snp]
+            keep = place >= 0
+            sink.append({column:numpy.asarray(values)[keep] for column, values in block.items()},
+                        order=mediator[keep]*self.sizes[name] + place[keep])
+
+    def close(self):
+        return sum(sink.close() for sink in self.sinks.values())
+
+    def discard(self):
+        for sink in self.sinks.values():
+            sink.discard()
+
+class PartitionMemo(object):
+    # LRU-bounded test results per distinct AA/BB partition
+    def __init__(self,maxSize=2**14):
+        self.maxSize = maxSize
+        self.results = collections.OrderedDict()
+        self.requested = 0
+        self.tested = 0
+        self.tests = 0
+
+    def get(self,key):
+        row = self.results.get(key)
+        if row is not None:
+            self.results.move_to_end(key)
+        return row
+
+    def put(self,key,row):
+        self.results[key] = row
+        if len(self.results) > self.maxSize:
+            self.results.popitem(last=False)
+
+def testPartitions(rankedList,maskAA,maskBB,pool=None,mediators=None,progress=None):
+    # testMediators on all or the given mediators, on pool when there is one;
+    # progress(done, total) is called as mediators (or pool chunks) finish
+    if pool is not None:
+        return pool.testMasks(maskAA,maskBB,progress=progress,mediators=mediators)
+    if mediators is not None:
+        rankedList = [rankedList[c] for c in mediators]
+    return testMediators(rankedList,maskAA,maskBB,progress)
+
+def testUnique(rankedList,maskAA,maskBB,pool=None,mediators=None,memo=None,progress=None):
+    # SNPs in LD often share a partition: each distinct (AA set, BB set) is
+    # tested once, or taken from memo, and the results fanned back out
+    packed = numpy.concatenate([numpy.packbits(maskAA,axis=1),numpy.packbits(maskBB,axis=1)],axis=1)
+    _, first, inverse = numpy.unique(packed,axis=0,return_index=True,return_inverse=True)
+    inverse = inverse.ravel()
+    tag = None if mediators is None else tuple(int(c) for c in mediators)
+    keys = [(packed[i].tobytes(),tag) for i in first]
+    shape = (len(first),len(rankedList) if mediators is None else len(mediators))
+    results = (numpy.zeros(shape),numpy.zeros(shape),numpy.zeros(shape,dtype=numpy.int64),numpy.zeros(shape,dtype=numpy.int64))
+    todo = []
+    for k in range(len(keys)):
+        row = memo.get(keys[k]) if memo is not None else None
+        if row is None:
+            todo.append(k)
+            continue
+        for target, value in zip(results,row):
+            target[k] = value
+    if len(todo) > 0:
+        tested = testPartitions(rankedList,maskAA[first[todo]],maskBB[first[todo]],pool,mediators,progress)
+        for target, value in zip(results,tested):
+            target[todo] = value
+        if memo is not None:
+            for j in range(len(todo)):
+                memo.put(keys[todo[j]],tuple(value[j].copy() for value in tested))
+    if memo is not None:
+        memo.requested += len(inverse)
+        memo.tested += len(todo)
+        memo.tests += len(todo)*shape[1]
+    return tuple(target[inverse] for target in results)
+
+def sortCytokineForSNP(snps,cyts,patientsAA,patientsBB,cytTable,startTime,sink,workers=1,blockSize=2**14,checkpoint=None,
+                       stateDir=None,trace=None):
+    # tests SNPs a block at a time and hands each block's rows to sink;
+    # blocks already in checkpoint are read back instead of retested, and
+    # with a stateDir only cells whose SNP or mediator changed since the
+    # last run are tested, the rest taken from the saved ScanState.
+    # trace (Instrument.Trace) gets the test counters and progress, also
+    # within a block; when it is cancelled the scan stops part way through the
+    # current block and keeps the blocks finished before it.
+    # returns the per-SNP significance counts of the SNPs finished
+    print(str(len(snps))+' Candidate SNPs')
+    patients = list(cytTable['patient'].cat.categories)
+    observations = mediatorObservations(cytTable)
+    rankedList = [BatchMWU.rankObservations(*observations[cyt]) for cyt in cyts]
+    memo = PartitionMemo()
+    state = None
+    reused = 0
+    restored = 0
+    skipped = 0
+    if stateDir is not None:
+        state = ScanState.ScanState(stateDir,snps,cyts,ScanState.mediatorFingerprints(observations,cyts,patients))
+    names = numpy.array(snps,dtype=object)
+    sigCytCount = numpy.zeros(len(snps),dtype=numpy.int64)
+    done = 0
+    pool = None
+    if trace is not None:
+        def blockProgress(tested,total):
+            # progress inside the current block, so a single-block scan still reports and cancels
+            trace.progress(blockStart + len(block)*tested/max(1,total),len(snps),'SNPs')
+            if trace.cancelled:
+                raise Instrument.Cancelled()
+    else:
+        blockProgress = None
+    try:
+        for blockStart in range(0,len(snps),blockSize):
+            block = snps[blockStart:blockStart+blockSize]
+            chunk = blockStart // blockSize
+            maskAA, maskBB = partitionMasks(block,patients,patientsAA,patientsBB)
+            if state is not None:
+                prints = ScanState.snpFingerprints(maskAA,maskBB,patients)
+            try:
+                if checkpoint is not None and checkpoint.has(chunk):
+                    U, p, nAA, nBB = checkpoint.load(chunk,'U','p','nAA','nBB')
+                    restored += U.size
+                else:
+                    if state is not None:
+                        U, p, nAA, nBB, missing = state.lookup(block,prints)
+                        reused += int((~missing).sum())
+                    else:
+                        missing = numpy.ones((len(block),len(cyts)),dtype=bool)
+                    #SNPs not seen before get every mediator; the others only the new or changed ones
+                    allRows = missing.all(axis=1)
+                    someRows = missing.any(axis=1) & ~allRows
+                    someCols = numpy.flatnonzero(missing[someRows].any(axis=0))
+                    if (allRows.any() or someRows.any()) and workers > 1 and pool is None:
+                        import SNPParallel
+                        pool = SNPParallel.MediatorPool(rankedList,len(patients),workers)
+                    if allRows.all():
+                        U, p, nAA, nBB = testUnique(rankedList,maskAA,maskBB,pool,memo=memo,progress=blockProgress)
+                    elif allRows.any():
+                        results = testUnique(rankedList,maskAA[allRows],maskBB[allRows],pool,memo=memo,progress=blockProgress)
+                        for target, result in zip((U,p,nAA,nBB),results):
+                            target[allRows] = result
+                    if someRows.any():
+                        cells = numpy.ix_(someRows,someCols)
+                        results = testUnique(rankedList,maskAA[someRows],maskBB[someRows],pool,someCols,memo,progress=blockProgress)
+                        for target, result in zip((U,p,nAA,nBB),results):
+                            target[cells] = result
+                    if checkpoint is not None:
+                        checkpoint.save(chunk,U=U,p=p,nAA=nAA,nBB=nBB)
+            except Instrument.Cancelled:
+                print('Cancelled after ' + str(done) + ' of ' + str(len(snps)) + ' SNPs')
+                break
+            if state is not None:
+                state.store(blockStart,prints,U,p,nAA,nBB)
+            ratios = numpy.array([str(len(patientsAA[name])) + 'AA : ' + str(len(patientsBB[name])) + 'BB' for name in block],dtype=object)
+            tested = (nAA > 0) & (nBB > 0)
+            skipped += int((~tested).sum())
+            sigCytCount[blockStart:blockStart+len(block)] = (tested & (p < 0.05)).sum(axis=1)
+            for c in range(len(cyts)):
+                t = tested[:,c]
+                #rows keep the old mediator-major order for ties in the p Value sort
+                sink.append({'SNP':names[blockStart:blockStart+len(block)][t],
+                             'Mediator':numpy.full(t.sum(),cyts[c],dtype=object),
+                             'p Value':p[t,c],
+                             'Mann-Whitney U Score':U[t,c],
+                             'ratio':ratios[t]},
+                            order=c*len(snps) + blockStart + numpy.flatnonzero(t))
+            done = blockStart + len(block)
+            print(str(int(100*done/len(snps)))+'% complete: '+str(time.time()-startTime), str(done))
+            if trace is not None:
+                trace.progress(done,len(snps),'SNPs')
+                if trace.cancelled and done < len(snps):
+                    print('Cancelled after ' + str(done) + ' of ' + str(len(snps)) + ' SNPs')
+                    break
+    finally:
+        if pool is not None and done < len(snps):
+            pool.terminate()
+        elif pool is not None:
+            pool.close()
+    if memo.requested > memo.tested:
+        print('Tested ' + str(memo.tested) + ' distinct partitions for ' + str(memo.requested) + ' SNPs')
+    if state is not None and done < len(snps):
+        state.discard()
+    elif state is not None:
+        state.commit()
+        print('Reused ' + str(reused) + ' of ' + str(len(snps)*len(cyts)) + ' SNP x mediator results')
+    if trace is not None:
+        trace.count('tests run',memo.tests)
+        trace.count('tests skipped for empty groups',skipped)
+        trace.count('partitions tested',memo.tested)
+        trace.count('results reused',reused)
+        trace.count('results from checkpoint',restored)
+    significanceCount = pandas.DataFrame({'SNP Name':names[:done],
+                                          'Number Significant Mediators':sigCytCount[:done]})
+    return significanceCount
+
+def writeResults(significanceCount,outputName):
+    if len(significanceCount.index) > 0:
+        significanceCount = significanceCount.sort_values('Number Significant Mediators',axis=0,ascending=True,kind='mergesort')
+        significanceCount.to_csv(outputName+' Table.csv',index=False,sep=',',mode='w',chunksize=15000)
+    else:
+        print('No statistically significant SNP-mediator permutations found.')
+    return significanceCount
+
+def plotSignificance(significanceCount,outputName):
+    import matplotlib.pyplot
+    if len(significanceCount.index) < 1:
+        return
+    graph = significanceCount.plot(kind='bar',title=outputName+': Number Statistically Significant Inflammatory Mediators per SNP',fontsize=14)
+    graph.set_xlabel('SNPs',fontsize=12)
+    graph.set_ylabel('Frequency',fontsize=12)
+    matplotlib.pyplot.show()
+
+def scan(path,sheet,cell,outputName,cache=None,chunksize=None,workers=1,fileFormat='csv',compression=None,
+         checkpoint=True,blockSize=2**14,incremental=False,trace=None,scenarios=None):
+    # chunksize streams a CSV or .xlsx sheet instead of loading it whole (bypasses the cache);
+    # checkpoint keeps finished SNP blocks in '<outputName> Checkpoint' until the outputs are written;
+    # incremental reuses the unchanged SNP x mediator results kept in '<outputName> State';
+    # trace (Instrument.Trace) records the stages and counters of the run; a
+    # run cancelled while testing writes the finished SNPs' results and keeps
+    # its checkpoint, so scanning again resumes where it stopped.
+    # scenarios: names of screening scenarios to run together instead of the
+    # equal distribution screen; the SNPs passing any of them are tested once and
+    # each scenario gets its own '<outputName> <scenario> Report' and ' Table'.
+    # returns the ' Report' path and the significance counts, or with scenarios
+    # {scenario: path} and {scenario: counts}
+    trace = Instrument.Trace() if trace is None else trace
+    screen = screenMask
+    if scenarios is not None:
+        checkScenarios(scenarios)
+        screen = lambda store: numpy.logical_or.reduce(list(screenScenarios(store,scenarios).values()))
+    if chunksize is not None and (path.endswith('.csv') or path.endswith('.xlsx')):
+        with trace.stage('read+reduce'):
+            data, store, cyts, cytokineIndices = streamReduce(path,chunksize,screen=screen,trace=trace,sheet=sheet,cell=cell)
+            patients = store.genotypedPatients()
+    else:
+        with trace.stage('read'):
+            data = SNPReader.readFile(path,sheet,cell,cache=cache)
+        with trace.stage('reduce'):
+            data, store, cyts, cytokineIndices = reduceData(data)
+            patients = store.genotypedPatients()
+        trace.count('SNPs screened',len(store))
+    with trace.stage('cytokines'):
+        cytTable = buildCytokineTable(data,cytokineIndices,patients)
+    groups = None
+    with trace.stage('screen'):
+        if scenarios is None:
+            goodSNPs, SNPsAndPatientsAA, SNPsAndPatientsBB = screenSNPs(store)
+        else:
+            #a SNP name on several rows is tested from its first row, when that passes any scenario
+            masks = screenScenarios(store,scenarios)
+            goodSNPs, SNPsAndPatientsAA, SNPsAndPatientsBB = screenSNPs(store,numpy.logical_or.reduce(list(masks.values())))
+            groups = scenarioSNPs(store,masks,goodSNPs)
+    trace.count('SNPs passing',len(goodSNPs))
+    for name, members in (groups or {}).items():
+        trace.count('SNPs passing ' + name,len(members))
+    return testAndWrite(path,sheet,cell,outputName,goodSNPs,cyts,SNPsAndPatientsAA,SNPsAndPatientsBB,cytTable,workers,
+                        fileFormat,compression,checkpoint,blockSize,incremental,trace,groups,
+                        None if cache is None else cache.knownHash(path))
+
+def testAndWrite(path,sheet,cell,outputName,goodSNPs,cyts,SNPsAndPatientsAA,SNPsAndPatientsBB,cytTable,workers=1,
+                 fileFormat='csv',compression=None,checkpoint=True,blockSize=2**14,incremental=False,trace=None,groups=None,
+                 inputHash=None):
+    # the test and write stages of scan, for screened SNPs; groups: {name: SNPs}
+    # splits the outputs into '<outputName> <name> Report' and ' Table' per group;
+    # inputHash: the input's SNPCache.fileHash when the caller already has it
+    trace = Instrument.Trace() if trace is None else trace
+    resume = None
+    if checkpoint:
+        resume = Checkpoint.Checkpoint.forInput(outputName,path,{'stage':'scan','sheet':sheet,'cell':cell,'mediators':cyts,
+                                                                  'snps':Checkpoint.listDigest(goodSNPs),'blockSize':blockSize},
+                                                inputHash)
+    if groups is None:
+        sink = reportSink(outputName,fileFormat,compression)
+    else:
+        sink = SplitSink(outputName,goodSNPs,groups,fileFormat,compression)
+    try:
+        with trace.stage('test'):
+            significanceCount = sortCytokineForSNP(goodSNPs,cyts,SNPsAndPatientsAA,SNPsAndPatientsBB,cytTable,time.time(),sink,
+                                                   workers,blockSize,resume,outputName + ' State' if incremental else None,trace)
+        finished = len(significanceCount) == len(goodSNPs)
+        with trace.stage('write',cancellable=False):
+            if groups is None:
+                significanceCount = writeResults(significanceCount,outputName)
+                trace.count('table rows written',len(significanceCount))
+            else:
+                tested = significanceCount
+                significanceCount = collections.OrderedDict()
+                for name, members in groups.items():
+                    rows = tested[tested['SNP Name'].isin(set(members))]
+                    significanceCount[name] = writeResults(rows,outputName + ' ' + name)
+                    trace.count('table rows written',len(rows))
+            trace.count('report rows written',sink.close())
+    except BaseException:
+        sink.discard()
+        raise
+    if resume is not None and finished:
+        resume.remove()
+    return sink.path, significanceCount
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--cache-dir',default=SNPCache.defaultCacheDir,help='where parsed workbooks are cached')
+    common.add_argument('--cache-size',type=float,default=SNPCache.defaultMaxBytes/2**30,help='cache size limit in GB')
+    common.add_argument('--no-cache',action='store_true',help='always re-parse the workbook')
+    common.add_argument('--no-checkpoint',action='store_true',help='do not keep finished chunks for resuming an interrupted run')
+    common.add_argument('--trace',default=None,metavar='FILE',
+                        help='write stage times, memory and counters to FILE (.json, or .csv)')
+    common.add_argument('--trace-memory',action='store_true',help='also trace Python allocations per stage (slower)')
+    common.add_argument('--profile',default=None,metavar='STAGE',
+                        help='run STAGE (e.g. read, reduce, cytokines, screen, test) under cProfile')
+    parser = argparse.ArgumentParser(description='Scan a SNP/cytokine workbook without the Qt dialogs.')
+    stages = parser.add_subparsers(dest='stage',required=True)
+    scanParser = stages.add_parser('scan',parents=[common],help='find SNPs whose AA/BB groups differ in mediator levels')
+    scanParser.add_argument('path')
+    scanParser.add_argument('-s','--sheet',default='Sheet1')
+    scanParser.add_argument('-c','--cell',default='A1')
+    scanParser.add_argument('-o','--output',required=True,help='output name; writes "<output> Report.csv" and "<output> Table.csv"')
+    scanParser.add_argument('--stream',type=int,default=None,metavar='ROWS',
+                            help='stream a CSV or .xlsx sheet in chunks of ROWS rows, keeping only SNPs that pass the screen')
+    scanParser.add_argument('-j','--workers',type=int,default=1,help='test SNP chunks on this many processes')
+    scanParser.add_argument('--incremental',action='store_true',
+                            help='only retest SNP x mediator cells whose genotypes or mediator data changed since the last --incremental run')
+    scanParser.add_argument('--format',default='csv',choices=['csv','parquet'],help='file format of the Report')
+    scanParser.add_argument('--compression',default=None,
+                            help='Report compression: gzip, bz2 or xz for csv; snappy, gzip, zstd, ... for parquet')
+    scanParser.add_argument('--scenario',action='append',default=None,choices=list(scenarios),
+                            help='screen with this scenario instead of equal distribution; repeat to run several in one pass, '
+                                 'each writing "<output> <scenario> Report.csv" and " Table.csv"')
+    scanParser.add_argument('--plot',action='store_true',help='show the significance bar chart (needs matplotlib)')
+    haploParser = stages.add_parser('haplotype',parents=[common],help='detect haplotypes from a list of SNPs')
+    haploParser.add_argument('path')
+    haploParser.add_argument('-s','--sheet',default='Sheet1')
+    haploParser.add_argument('--snps',nargs='+',default=[])
+    haploParser.add_argument('--region',action='append',default=[],metavar='CHR[:START-STOP]',
+                             help='also compare the SNPs of a genomic region, e.g. chr2:1000-50000; repeatable')
+    haploParser.add_argument('--params',nargs='+',required=True,help='mediator name patterns to compare')
+    haploParser.add_argument('-n','--haplo-size',type=int,default=2,choices=[2,3,4])
+    haploParser.add_argument('--min-count',type=int,default=20,help='fewest patients a haplotype must have to be kept and extended')
+    haploParser.add_argument('-j','--workers',type=int,default=4,help='processes for the mediator comparisons')
+    haploParser.add_argument('--patients',default=None,help='workbook whose patient_id column restricts the cohort')
+    haploParser.add_argument('--patient-sheet',default='Deriv Total')
+    haploParser.add_argument('-o','--output',required=True)
+    args = parser.parse_args(argv)
+    cache = None if args.no_cache else SNPCache.DataCache(args.cache_dir,int(args.cache_size*2**30))
+    trace = Instrument.Trace(memory=args.trace_memory,profile=args.profile)
+    if args.stage == 'scan':
+        report, significanceCount = scan(args.path,args.sheet,args.cell,args.output,cache=cache,chunksize=args.stream,
+                                         workers=args.workers,fileFormat=args.format,compression=args.compression,
+                                         checkpoint=not args.no_checkpoint,incremental=args.incremental,trace=trace,
+                                         scenarios=args.scenario)
+        if args.plot and args.scenario is None:
+            plotSignificance(significanceCount,args.output)
+        elif args.plot:
+            for name in significanceCount:
+                plotSignificance(significanceCount[name],args.output + ' ' + name)
+    elif args.stage == 'haplotype':
+        import HaplotypeEngine
+        import SNPIndex
+        try:
+            snps = list(args.snps)
+            if len(args.region) > 0:
+                index = SNPIndex.SNPIndex.forFile(args.path,args.sheet,cache=cache)
+                snps = list(dict.fromkeys(snps + [n for text in args.region for n in index.regionNames(text)]))
+            HaplotypeEngine.run(args.haplo_size,args.params,snps,args.path,args.sheet,args.output,
+                                patientFile=args.patients,patientSheet=args.patient_sheet,cache=cache,
+                                workers=args.workers,minCount=args.min_count,checkpoint=not args.no_checkpoint,trace=trace)
+        except ValueError as e:
+            print('Error: ' + str(e))
+            return 1
+    print(trace.report())
+    if args.trace is not None:
+        trace.write(args.trace)
+    elif args.profile in trace.profiles:
+        print(trace.profileText(args.profile))
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
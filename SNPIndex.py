@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+'''
+SNPIndex
+
+SNP name -> sheet row and chromosome/position -> sheet rows for one
+workbook. The index is a small frame of the Name, Chr and Position
+columns sorted by chromosome and position; it is built once per input and
+kept in the SNPCache directory, so later runs load it instead of scanning
+the sheet. Name lookups are hashed; region queries are binary searches
+within one chromosome.
+
+Run "python SNPIndex.py <file> --snps rs1 rs2" or "--region chr2:1000-50000".
+'''
+
+import sys
+import argparse
+import numpy
+import pandas
+
+import SNPCache
+import SNPReader
+
+indexColumns = ['Name','Chr','Position']
+
+def chromKey(value):
+    # 'chr2', 2, 2.0 and '2' are all chromosome '2'
+    if value is None or value != value:
+        return None
+    if isinstance(value,float) and value.is_integer():
+        value = int(value)
+    key = str(value).strip().upper()
+    return key[3:] if key.startswith('CHR') else key
+
+def parseRegion(text):
+    # 'chr2:1000-50000' -> ('2', 1000, 50000); 'X' and '7:100-' leave the ends open
+    chrom, _, span = text.partition(':')
+    start, _, stop = span.partition('-')
+    toNumber = lambda s: float(s.replace(',','')) if len(s.strip()) > 0 else None
+    try:
+        return chromKey(chrom), toNumber(start), toNumber(stop)
+    except ValueError:
+        raise ValueError('Not a region like chr2:1000-50000: ' + text)
+
+def indexFrame(chunks):
+    # Name, Chr, Position and sheet row of every named row, sorted by Chr, Position, row
+    frames = []
+    for chunk in chunks:
+        if 'Name' not in chunk or 'Chr' not in chunk:
+            raise ValueError('No Name and Chr columns to index in the sheet')
+        if 'Position' not in chunk:
+            chunk = chunk.assign(Position=numpy.nan)
+        frame = pandas.DataFrame({'Name':chunk['Name'].to_numpy(dtype=object),
+                                  'Chr':chunk['Chr'].map(chromKey).to_numpy(dtype=object),
+                                  'Position':pandas.to_numeric(chunk['Position'],errors='coerce').to_numpy(dtype=float),
+                                  'row':chunk.index.to_numpy(dtype=numpy.int64)})
+        frames.append(frame[frame['Name'].notnull()])
+    frame = pandas.concat(frames,ignore_index=True)
+    #names are kept exactly as in the sheet, as GenotypeStore.snpIndex keys them
+    frame['Chr'] = frame['Chr'].fillna('')
+    return frame.sort_values(['Chr','Position','row'],kind='mergesort',ignore_index=True)
+
+class SNPIndex(object):
+    def __init__(self,frame):
+        self.frame = frame
+        #first sheet row of each name, as data[data.Name == n].index[0] gives
+        self.nameRows = frame.groupby('Name',sort=False)['row'].min()
+        chroms = frame['Chr'].to_numpy(dtype=object)
+        bounds = numpy.flatnonzero(numpy.r_[True,chroms[1:] != chroms[:-1],True]) if len(chroms) > 0 else numpy.zeros(1,dtype=int)
+        self.chromSpans = {chroms[bounds[i]]:(bounds[i],bounds[i+1]) for i in range(len(bounds) - 1)}
+        self.chromSpans.pop('',None)
+        self.positions = frame['Position'].to_numpy(dtype=float)
+        self.rowsByPosition = frame['row'].to_numpy(dtype=numpy.int64)
+        self.rowNames = pandas.Series(frame['Name'].to_numpy(dtype=object),index=self.rowsByPosition)
+
+    @classmethod
+    def forFile(cls,path,sheet='Sheet1',cell='A1',cache=None,data=None):
+        # data: the sheet when it is already loaded, read for the index otherwise
+        if data is not None:
+            build = lambda: indexFrame([data])
+        elif path.endswith('.csv'):
+            build = lambda: indexFrame(SNPReader.iterCSV(path,usecols=lambda column: column in indexColumns))
+        else:
+            build = lambda: indexFrame(chunk.filter(indexColumns) for chunk in SNPReader.iterChunks(path,sheet,cell))
+        if cache is None:
+            return cls(build())
+        return cls(cache.load(path,{'reader':'snpIndex','names':'raw','sheet':sheet,'cell':cell},build))
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __contains__(self,name):
+        return name in self.nameRows.index
+
+    def rows(self,names):
+        # sheet rows of the names, in the given order
+        rows = self.nameRows.reindex(list(names))
+        if rows.isnull().any():
+            missing = [str(n) for n in rows[rows.isnull()].index]
+            raise ValueError('SNPs not found: ' + ', '.join(missing[:10]) + (' ...' if len(missing) > 10 else ''))
+        return list(rows.astype(numpy.int64))
+
+    def region(self,chrom,start=None,stop=None):
+        # sheet rows of the SNPs on chrom with start <= Position <= stop, by position
+        first, last = self.chromSpans.get(chromKey(chrom),(0,0))
+        positions = self.positions[first:last]
+        lo = 0 if start is None else numpy.searchsorted(positions,start,side='left')
+        hi = len(positions) if stop is None else numpy.searchsorted(positions,stop,side='right')
+        return list(self.rowsByPosition[first+lo:first+max(lo,hi)])
+
+    def names(self,rows):
+        # SNP names of sheet rows
+        return list(self.rowNames.reindex(list(rows)))
+
+    def regionNames(self,text):
+        # unique SNP names of a 'chr2:1000-50000' region, by position
+        return list(dict.fromkeys(self.names(self.region(*parseRegion(text)))))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Look SNPs up by name or genomic region.')
+    parser.add_argument('path')
+    parser.add_argument('-s','--sheet',default='Sheet1')
+    parser.add_argument('-c','--cell',default='A1')
+    parser.add_argument('--snps',nargs='+',default=[])
+    parser.add_argument('--region',action='append',default=[],metavar='CHR[:START-STOP]')
+    parser.add_argument('--cache-dir',default=SNPCache.defaultCacheDir,help='where the index is kept')
+    parser.add_argument('--no-cache',action='store_true',help='rebuild the index instead of loading it')
+    args = parser.parse_args(argv)
+    cache = None if args.no_cache else SNPCache.DataCache(args.cache_dir)
+    try:
+        index = SNPIndex.forFile(args.path,args.sheet,args.cell,cache)
+        print(str(len(index)) + ' named rows, ' + str(len(index.chromSpans)) + ' chromosomes')
+        rows = index.rows(args.snps)
+        for text in args.region:
+            rows += index.region(*parseRegion(text))
+    except ValueError as e:
+        print('Error: ' + str(e))
+        return 1
+    if len(rows) > 0:
+        print(index.frame.set_index('row').loc[rows,indexColumns].to_string())
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
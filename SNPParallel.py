@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+'''
+SNPParallel
+
+Process-pool execution of the batched SNP x mediator tests. The AA/BB
+partition masks and the ranked mediator observations are copied into
+shared memory once; workers attach to them at start-up and each task only
+carries a (start, stop) range of candidate SNPs.
+'''
+
+import os
+import numpy
+import multiprocessing
+from multiprocessing import shared_memory
+
+import BatchMWU
+
+class SharedArrays(object):
+    # copies named numpy arrays into shared memory blocks owned by this process
+    def __init__(self,arrays):
+        self.blocks = []
+        self.spec = {}
+        for name, array in arrays.items():
+            array = numpy.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True,size=max(1,array.nbytes))
+            numpy.ndarray(array.shape,dtype=array.dtype,buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.spec[name] = (block.name,array.shape,array.dtype.str)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+def attach(spec):
+    # numpy views on blocks made by SharedArrays; returns (arrays, handles)
+    arrays = {}
+    handles = []
+    for name, (blockName, shape, dtype) in spec.items():
+        #pool workers share the parent's resource tracker, so attaching does not hand them ownership
+        block = shared_memory.SharedMemory(name=blockName)
+        handles.append(block)
+        arrays[name] = numpy.ndarray(shape,dtype=numpy.dtype(dtype),buffer=block.buf)
+    return arrays, handles
+
+def packRanked(rankedList):
+    # one flat set of arrays for all mediators plus offsets into them
+    valueOffsets = numpy.cumsum([0] + [len(r[0]) for r in rankedList])
+    startOffsets = numpy.cumsum([0] + [len(r[2]) for r in rankedList])
+    concat = lambda k, dtype: numpy.concatenate([r[k] for r in rankedList]).astype(dtype) if len(rankedList) > 0 else numpy.zeros(0,dtype=dtype)
+    return {'values':concat(0,numpy.float64),
+            'owners':concat(1,numpy.intp),
+            'starts':concat(2,numpy.intp),
+            'valueOffsets':valueOffsets,
+            'startOffsets':startOffsets}
+
+def unpackRanked(arrays,c):
+    a, b = arrays['valueOffsets'][c], arrays['valueOffsets'][c+1]
+    s, t = arrays['startOffsets'][c], arrays['startOffsets'][c+1]
+    return arrays['values'][a:b], arrays['owners'][a:b], arrays['starts'][s:t]
+
+_shared = None
+_attached = {}
+
+def _initWorker(spec):
+    global _shared
+    _shared = attach(spec)
+
+def _testMediators(arrays,maskAA,maskBB,mediators=None):
+    if mediators is None:
+        mediators = range(len(arrays['valueOffsets']) - 1)
+    results = numpy.zeros((4,maskAA.shape[0],len(mediators)))
+    for k, c in enumerate(mediators):
+        U1, p, nA, nB = BatchMWU.mannWhitneyRanked(unpackRanked(arrays,c),maskAA,maskBB)
+        results[0,:,k] = U1
+        results[1,:,k] = p
+        results[2,:,k] = nA
+        results[3,:,k] = nB
+    return results
+
+def _testRange(task):
+    # task: (start, stop, spec of the shared masks for this call, mediator indices or None)
+    start, stop, maskSpec, mediators = task
+    key = tuple(sorted(v[0] for v in maskSpec.values()))
+    if key not in _attached:
+        for arrays, handles in _attached.values():
+            arrays.clear()#masks of earlier calls are unlinked by now
+        _attached.clear()
+        _attached[key] = attach(maskSpec)
+    masks = _attached[key][0]
+    return start, stop, _testMediators(_shared[0],masks['maskAA'][start:stop],masks['maskBB'][start:stop],mediators)
+
+def _testGroups(task):
+    # task: (start, [(patient indices A, patient indices B), ...])
+    start, groups = task
+    nPatients = _shared[0]['nPatients'][0]
+    maskAA = numpy.zeros((len(groups),nPatients),dtype=bool)
+    maskBB = numpy.zeros((len(groups),nPatients),dtype=bool)
+    for i in range(len(groups)):
+        maskAA[i,groups[i][0]] = True
+        maskBB[i,groups[i][1]] = True
+    return start, start + len(groups), _testMediators(_shared[0],maskAA,maskBB)
+
+def defaultWorkers():
+    return os.cpu_count() or 1
+
+class MediatorPool(object):
+    # Long-lived pool whose workers hold the ranked mediator observations in
+    # shared memory; reuse one instance for every batch of a run.
+    def __init__(self,rankedList,nPatients,workers=None):
+        self.workers = workers or defaultWorkers()
+        self.nCyt = len(rankedList)
+        arrays = packRanked(rankedList)
+        arrays['nPatients'] = numpy.array([nPatients],dtype=numpy.intp)
+        self.shared = SharedArrays(arrays)
+        self.pool = multiprocessing.Pool(self.workers,initializer=_initWorker,initargs=(self.shared.spec,))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.shared.close()
+
+    def terminate(self):
+        # stops the workers without running the queued chunks
+        self.pool.terminate()
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        if exc[0] is not None:
+            self.terminate()
+        else:
+            self.close()
+
+    def collect(self,tasks,function,total,progress=None,nCyt=None):
+        nCyt = self.nCyt if nCyt is None else nCyt
+        U = numpy.zeros((total,nCyt))
+        p = numpy.zeros((total,nCyt))
+        nA = numpy.zeros((total,nCyt),dtype=numpy.int64)
+        nB = numpy.zeros((total,nCyt),dtype=numpy.int64)
+        done = 0
+        for start, stop, results in self.pool.imap_unordered(function,tasks):
+            U[start:stop] = results[0]
+            p[start:stop] = results[1]
+            nA[start:stop] = results[2]
+            nB[start:stop] = results[3]
+            done += stop - start
+            if progress is not None:
+                progress(done,total)
+        return U, p, nA, nB
+
+    def testMasks(self,maskAA,maskBB,chunksize=None,progress=None,mediators=None):
+        # U, p, nAA, nBB for every mask row x mediator (or x the given mediator indices)
+        nRows = maskAA.shape[0]
+        if chunksize is None:
+            chunksize = max(64,-(-nRows // (self.workers*4)))
+        mediators = None if mediators is None else [int(c) for c in mediators]
+        with SharedArrays({'maskAA':maskAA,'maskBB':maskBB}) as masks:
+            tasks = [(start,min(nRows,start+chunksize),masks.spec,mediators) for start in range(0,nRows,chunksize)]
+            return self.collect(tasks,_testRange,nRows,progress,None if mediators is None else len(mediators))
+
+    def testGroups(self,groups,batchSize=64,progress=None):
+        # groups: [(patient indices A, patient indices B), ...]; batches of pairs per task
+        tasks = [(start,[(numpy.asarray(a,dtype=numpy.intp),numpy.asarray(b,dtype=numpy.intp)) for a, b in groups[start:start+batchSize]])
+                 for start in range(0,len(groups),batchSize)]
+        return self.collect(tasks,_testGroups,len(groups),progress)
+
+def testMediatorsParallel(rankedList,maskAA,maskBB,workers=None,chunksize=None,progress=None):
+    # same arrays as SNPEngine.testMediators: U, p, nAA, nBB, each SNPs x mediators
+    with MediatorPool(rankedList,maskAA.shape[1],workers) as pool:
+        return pool.testMasks(maskAA,maskBB,chunksize,progress)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+'''
+SNPReader
+
+Workbook readers shared by SNP Scanner, HaplotypeHelper and SNPControlCheck.
+.xlsx sheets are streamed row by row with openpyxl in read-only mode,
+starting at the given cell, so the rows and columns before it are never
+loaded.
+'''
+
+import xlsxwriter
+import pandas
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+def startRowCol(cell):
+    # zero-based (row, column) of a cell like 'C5'; blank means 'A1'
+    if cell is None or len(cell.strip()) == 0:
+        cell = 'A1'
+    return xlsxwriter.utility.xl_cell_to_rowcol(cell.strip())
+
+def getXLSCoords(cell):
+    # read_excel arguments: rows to skip, columns to use
+    row,col = startRowCol(cell)
+    skiprows = None
+    usecols = None
+    if(row > 0):
+        skiprows = range(row)
+    if(col > 0):
+        usecols = range(col,16384)
+    return skiprows, usecols
+
+def readCSV(path,cache=None,**options):
+    if cache is not None:
+        return cache.load(path,dict(options,reader='csv'),lambda: readCSV(path,**options))
+    df = pandas.read_csv(path,engine='python',header=0,iterator=True,
+                         chunksize=15000,**options)
+    return pandas.DataFrame(pandas.concat(df,ignore_index=True))
+
+def iterCSV(path,chunksize=15000,**options):
+    # C-engine chunks with every cell kept as its original string
+    return pandas.read_csv(path,header=0,chunksize=chunksize,dtype=object,**options)
+
+def iterExcel(path,sheet,cell='A1',chunksize=15000):
+    # .xlsx chunks like iterCSV's: the row at cell is the header, blank rows
+    # are skipped and cells keep openpyxl's values (None when empty)
+    if openpyxl is None:
+        raise ValueError('Reading .xlsx files needs openpyxl installed.')
+    row,col = startRowCol(cell)
+    book = openpyxl.load_workbook(path,read_only=True,data_only=True)
+    try:
+        rows = book[sheet].iter_rows(min_row=row+1,min_col=col+1,values_only=True)
+        header = list(next(rows,()))
+        while len(header) > 0 and header[-1] is None:
+            header.pop()
+        columns = ['Unnamed: ' + str(i) if header[i] is None else str(header[i]) for i in range(len(header))]
+        width = len(columns)
+        block = []
+        start = 0
+        for values in rows:
+            values = values[:width]
+            if all(v is None for v in values):
+                continue
+            block.append(values + (None,)*(width - len(values)))
+            if len(block) == chunksize:
+                yield pandas.DataFrame(block,columns=columns,index=range(start,start+len(block)),dtype=object)
+                start += len(block)
+                block = []
+        if len(block) > 0 or start == 0:
+            yield pandas.DataFrame(block,columns=columns,index=range(start,start+len(block)),dtype=object)
+    finally:
+        book.close()
+
+def readExcel(path,sheet,cell='A1',chunksize=15000):
+    if path.endswith('.xls'):
+        #openpyxl only reads .xlsx
+        skiprows, usecols = getXLSCoords(cell)
+        return pandas.read_excel(path,sheet_name=sheet,skiprows=skiprows,usecols=usecols)
+    data = pandas.concat(iterExcel(path,sheet,cell,chunksize))
+    #numeric columns as numbers, like read_excel and read_csv give them
+    return data.infer_objects()
+
+def iterChunks(path,sheet='Sheet1',cell='A1',chunksize=15000):
+    # iterCSV or iterExcel by file type
+    if path.endswith('.xlsx'):
+        return iterExcel(path,sheet,cell,chunksize)
+    return iterCSV(path,chunksize)
+
+def readFile(path,sheet,cell='A1',cache=None):
+    if cache is not None:
+        return cache.load(path,{'reader':'sheet','sheet':sheet,'cell':cell},lambda: readFile(path,sheet,cell))
+    data = pandas.DataFrame()
+    if(path.endswith('.xls') or path.endswith('.xlsx')):
+        data = readExcel(path,sheet,cell)
+    if(path.endswith('.csv')):
+        data = readCSV(path)
+    return data
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+'''
+ScanState
+
+Saved SNP x mediator results of a scan, for incremental rescans. Every
+candidate SNP is fingerprinted by its AA and BB patient sets and every
+mediator by its (patient, value) observations; a rescan reuses the cells
+whose SNP and mediator fingerprints are both unchanged and only tests the
+rest. The state directory holds one .npy file per array and is read with
+memory maps, a block of SNPs at a time.
+'''
+
+import os
+import shutil
+import hashlib
+import numpy
+
+stateArrays = ['U','p','nAA','nBB','snpPrints']
+
+def idHashes(ids,salt):
+    # stable 64-bit hash of every patient ID
+    return numpy.array([int.from_bytes(hashlib.blake2b(str(i).encode('utf-8'),digest_size=8,key=salt).digest(),'little')
+                        for i in ids],dtype=numpy.uint64)
+
+def mix(x):
+    # splitmix64 finalizer
+    x = x + numpy.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+    return x ^ (x >> numpy.uint64(31))
+
+def snpFingerprints(maskAA,maskBB,patients,chunksize=2048):
+    # (SNPs, 2) uint64; sums of per-patient hashes, so they do not depend on column order
+    lanes = [(idHashes(patients,b'AA1'),idHashes(patients,b'BB1')),(idHashes(patients,b'AA2'),idHashes(patients,b'BB2'))]
+    prints = numpy.zeros((maskAA.shape[0],2),dtype=numpy.uint64)
+    for start in range(0,maskAA.shape[0],chunksize):
+        stop = start + chunksize
+        for k, (hashAA, hashBB) in enumerate(lanes):
+            prints[start:stop,k] = (maskAA[start:stop]*hashAA).sum(axis=1,dtype=numpy.uint64) + \
+                                   (maskBB[start:stop]*hashBB).sum(axis=1,dtype=numpy.uint64)
+    return prints
+
+def mediatorFingerprints(observations,cyts,patients):
+    # observations: SNPEngine.mediatorObservations; (mediators, 2) uint64 over (patient, value) pairs
+    lanes = [idHashes(patients,b'obs1'),idHashes(patients,b'obs2')]
+    prints = numpy.zeros((len(cyts),2),dtype=numpy.uint64)
+    for c in range(len(cyts)):
+        values, owners = observations[cyts[c]]
+        bits = numpy.ascontiguousarray(values,dtype=numpy.float64).view(numpy.uint64)
+        for k in range(2):
+            prints[c,k] = mix(lanes[k][owners] ^ mix(bits)).sum(dtype=numpy.uint64) + numpy.uint64(len(values))
+    return prints
+
+class ScanState(object):
+    # previous results in directory are read; the new ones are written next to
+    # them and replace them on commit()
+    def __init__(self,directory,snps,cyts,cytPrints):
+        self.directory = directory
+        self.partial = directory + '.partial'
+        self.nCyt = len(cyts)
+        self.previous = self.readPrevious()
+        self.previousRow = {}
+        self.previousCol = numpy.full(len(cyts),-1)
+        if self.previous is not None:
+            names = self.previous['snpNames']
+            for i in range(len(names)):
+                self.previousRow.setdefault(str(names[i]),i)
+            oldCol = {str(self.previous['cytNames'][c]):c for c in range(len(self.previous['cytNames']))}
+            for c in range(len(cyts)):
+                old = oldCol.get(cyts[c],-1)
+                if old >= 0 and (self.previous['cytPrints'][old] == cytPrints[c]).all():
+                    self.previousCol[c] = old
+        shutil.rmtree(self.partial,ignore_errors=True)
+        os.makedirs(self.partial)
+        numpy.save(os.path.join(self.partial,'snpNames.npy'),numpy.array(snps,dtype=str))
+        numpy.save(os.path.join(self.partial,'cytNames.npy'),numpy.array(cyts,dtype=str))
+        numpy.save(os.path.join(self.partial,'cytPrints.npy'),numpy.asarray(cytPrints,dtype=numpy.uint64))
+        shape = (len(snps),len(cyts))
+        dtypes = {'U':numpy.float64,'p':numpy.float64,'nAA':numpy.int64,'nBB':numpy.int64}
+        self.current = {name:numpy.lib.format.open_memmap(os.path.join(self.partial,name + '.npy'),mode='w+',
+                                                          dtype=dtype,shape=shape) for name, dtype in dtypes.items()}
+        self.current['snpPrints'] = numpy.lib.format.open_memmap(os.path.join(self.partial,'snpPrints.npy'),mode='w+',
+                                                                 dtype=numpy.uint64,shape=(len(snps),2))
+
+    def readPrevious(self):
+        try:
+            previous = {name:numpy.load(os.path.join(self.directory,name + '.npy'),mmap_mode='r') for name in stateArrays}
+            for name in ['snpNames','cytNames','cytPrints']:
+                previous[name] = numpy.load(os.path.join(self.directory,name + '.npy'))
+            return previous
+        except (IOError,OSError,ValueError):
+            return None
+
+    def lookup(self,block,prints):
+        # previous U, p, nAA, nBB for a block of SNPs and the cells that must be (re)tested
+        shape = (len(block),self.nCyt)
+        U, p = numpy.zeros(shape), numpy.zeros(shape)
+        nAA, nBB = numpy.zeros(shape,dtype=numpy.int64), numpy.zeros(shape,dtype=numpy.int64)
+        missing = numpy.ones(shape,dtype=bool)
+        if self.previous is None:
+            return U, p, nAA, nBB, missing
+        rows = numpy.array([self.previousRow.get(name,-1) for name in block],dtype=numpy.intp)
+        known = rows >= 0
+        known[known] = (self.previous['snpPrints'][rows[known]] == prints[known]).all(axis=1)
+        cols = numpy.flatnonzero(self.previousCol >= 0)
+        if known.any() and len(cols) > 0:
+            cells = numpy.ix_(rows[known],self.previousCol[cols])
+            where = numpy.ix_(numpy.flatnonzero(known),cols)
+            U[where] = self.previous['U'][cells]
+            p[where] = self.previous['p'][cells]
+            nAA[where] = self.previous['nAA'][cells]
+            nBB[where] = self.previous['nBB'][cells]
+            missing[where] = False
+        return U, p, nAA, nBB, missing
+
+    def store(self,blockStart,prints,U,p,nAA,nBB):
+        stop = blockStart + len(prints)
+        self.current['snpPrints'][blockStart:stop] = prints
+        self.current['U'][blockStart:stop] = U
+        self.current['p'][blockStart:stop] = p
+        self.current['nAA'][blockStart:stop] = nAA
+        self.current['nBB'][blockStart:stop] = nBB
+
+    def discard(self):
+        # drops the new results, keeping the previous state
+        self.current = {}
+        shutil.rmtree(self.partial,ignore_errors=True)
+
+    def commit(self):
+        for array in self.current.values():
+            array.flush()
+        self.current = {}
+        self.previous = None
+        shutil.rmtree(self.directory,ignore_errors=True)
+        os.replace(self.partial,self.directory)
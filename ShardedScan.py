@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+'''
+ShardedScan
+
+SNPEngine.scan split into shards that run as separate processes or on
+separate machines sharing a directory. "plan" screens the SNP block once
+and splits the candidate SNPs into shards of equal size, recorded in
+'<output> Shards/manifest.json'; "shard" tests one shard and writes its
+partial Report and Table next to the manifest; "merge" orders the shard
+Reports by p Value and rebuilds the Table, giving the same
+'<output> Report' and '<output> Table' as a single scan. "run" plans,
+tests every shard as a local process and merges.
+
+Shards stream the sheet and keep only their own rows, so each parses at
+most the part of it up to its last SNP.
+
+Run "python ShardedScan.py run <file> -o <name> -n 8", or "plan" once,
+"shard <manifest> <k>" on each node and "merge <manifest>" at the end.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy
+import pandas
+
+import Instrument
+import SNPCache
+import SNPEngine
+import SNPReader
+
+manifestName = 'manifest.json'
+candidatesName = 'candidates.npy'
+
+def shardDir(outputName):
+    return outputName + ' Shards'
+
+def shardName(directory,shard):
+    # output name of one shard; its Report, Table, log and done marker start with it
+    return os.path.join(directory,'Shard %03d' % shard)
+
+def readJSON(path):
+    with open(path,'r') as f:
+        return json.load(f)
+
+def writeJSON(path,value):
+    tmpPath = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmpPath,'w') as f:
+        json.dump(value,f,indent=1)
+    os.replace(tmpPath,path)
+
+def readReduced(path,sheet,cell,cache=None,chunksize=None,screen=None,trace=None,lastRow=None):
+    # the read and reduce stages of SNPEngine.scan; screen and lastRow only apply when streaming
+    if chunksize is not None and (path.endswith('.csv') or path.endswith('.xlsx')):
+        with trace.stage('read+reduce'):
+            return SNPEngine.streamReduce(path,chunksize,screen=screen,trace=trace,sheet=sheet,cell=cell,lastRow=lastRow)
+    with trace.stage('read'):
+        data = SNPReader.readFile(path,sheet,cell,cache=cache)
+    with trace.stage('reduce'):
+        return SNPEngine.reduceData(data)
+
+def candidateRows(store):
+    # sheet rows of the SNP names whose first row passes the screen, as screenSNPs picks them
+    passing = numpy.flatnonzero(SNPEngine.screenMask(store) & store.firstRows())
+    return numpy.asarray(store.rows[passing],dtype=numpy.int64)
+
+def plan(path,sheet,cell,outputName,nShards,cache=None,chunksize=None,trace=None):
+    # writes the manifest and candidate rows; returns the manifest path
+    trace = Instrument.Trace() if trace is None else trace
+    data, store, cyts, cytokineIndices = readReduced(path,sheet,cell,cache,chunksize,SNPEngine.screenMask,trace)
+    #the cohort every shard ranks the mediators over, as the single scan would
+    patients = store.genotypedPatients()
+    with trace.stage('screen'):
+        rows = candidateRows(store)
+    trace.count('SNPs passing',len(rows))
+    nShards = max(1,min(nShards,len(rows)))
+    bounds = [int(b) for b in numpy.linspace(0,len(rows),nShards+1).round()]
+    directory = shardDir(outputName)
+    os.makedirs(directory,exist_ok=True)
+    for name in os.listdir(directory):
+        if name.startswith('Shard '):
+            os.remove(os.path.join(directory,name))#left from an earlier plan
+    numpy.save(os.path.join(directory,candidatesName),rows)
+    shards = []
+    for k in range(nShards):
+        start, stop = bounds[k], bounds[k+1]
+        shards.append({'shard':k,'start':start,'stop':stop,'snps':stop - start,
+                       'firstRow':int(rows[start]) if stop > start else None,
+                       'lastRow':int(rows[stop-1]) if stop > start else None})
+    manifest = {'path':os.path.abspath(path),'input':SNPCache.fileHash(path),'sheet':sheet,'cell':cell,
+                'output':os.path.abspath(outputName),'mediators':cyts,'patients':patients,
+                'candidates':len(rows),'shards':shards}
+    manifestPath = os.path.join(directory,manifestName)
+    writeJSON(manifestPath,manifest)
+    print('Planned ' + str(nShards) + ' shards of ' + str(len(rows)) + ' candidate SNPs: ' + manifestPath)
+    return manifestPath
+
+def finished(manifestPath,shard):
+    return os.path.exists(shardName(os.path.dirname(manifestPath),shard) + '.json')
+
+def runShard(manifestPath,shard,cache=None,chunksize=15000,workers=1,checkpoint=True,trace=None):
+    # tests one shard's SNPs into '<directory>/Shard k Report.csv' and ' Table.csv';
+    # the done marker 'Shard k.json' is only written once every SNP is tested.
+    # A CSV or .xlsx sheet is streamed in chunks of chunksize rows, keeping only
+    # the shard's rows and stopping after its last one; chunksize None (or an
+    # .xls file) parses the whole sheet instead, through cache.
+    trace = Instrument.Trace() if trace is None else trace
+    manifest = readJSON(manifestPath)
+    directory = os.path.dirname(manifestPath)
+    if shard < 0 or shard >= len(manifest['shards']):
+        raise ValueError('No shard ' + str(shard) + ' in ' + manifestPath)
+    entry = manifest['shards'][shard]
+    path = manifest['path']
+    if SNPCache.fileHash(path) != manifest['input']:
+        raise ValueError(path + ' has changed since the shards were planned')
+    rows = numpy.load(os.path.join(directory,candidatesName))[entry['start']:entry['stop']]
+    keep = lambda block: numpy.isin(block.rows,rows)
+    data, store, cyts, cytokineIndices = readReduced(path,manifest['sheet'],manifest['cell'],cache,chunksize,keep,trace,
+                                                     entry['lastRow'])
+    if cyts != manifest['mediators']:
+        raise ValueError('Mediators of ' + path + ' differ from the plan')
+    store = store.take(keep(store))
+    with trace.stage('cytokines'):
+        cytTable = SNPEngine.buildCytokineTable(data,cytokineIndices,manifest['patients'])
+    with trace.stage('screen'):
+        goodSNPs, SNPsAndPatientsAA, SNPsAndPatientsBB = SNPEngine.screenSNPs(store,numpy.ones(len(store),dtype=bool))
+    if len(goodSNPs) != entry['snps']:
+        raise ValueError('Shard ' + str(shard) + ' found ' + str(len(goodSNPs)) + ' of its ' + str(entry['snps']) + ' SNPs')
+    name = shardName(directory,shard)
+    report, significanceCount = SNPEngine.testAndWrite(path,manifest['sheet'],manifest['cell'],name,goodSNPs,cyts,
+                                                       SNPsAndPatientsAA,SNPsAndPatientsBB,cytTable,workers,
+                                                       checkpoint=checkpoint,trace=trace,inputHash=manifest['input'])
+    if len(significanceCount) == len(goodSNPs):
+        writeJSON(name + '.json',{'shard':shard,'snps':len(goodSNPs),'input':manifest['input']})
+    return report, significanceCount
+
+def runLocal(manifestPath,processes=None,options=()):
+    # every unfinished shard as a local process, at most processes at once,
+    # each logging to 'Shard k.log'; returns the shards that failed
+    manifest = readJSON(manifestPath)
+    todo = [entry['shard'] for entry in manifest['shards'] if not finished(manifestPath,entry['shard'])]
+    processes = len(todo) if processes is None else max(1,processes)
+    script = os.path.abspath(__file__)
+    running = {}
+    failed = []
+    while len(todo) > 0 or len(running) > 0:
+        while len(todo) > 0 and len(running) < processes:
+            shard = todo.pop(0)
+            log = open(shardName(os.path.dirname(manifestPath),shard) + '.log','w')
+            command = [sys.executable,script,'shard',manifestPath,str(shard)] + list(options)
+            running[shard] = (subprocess.Popen(command,stdout=log,stderr=subprocess.STDOUT),log)
+        for shard, (process, log) in list(running.items()):
+            if process.poll() is None:
+                continue
+            log.close()
+            del running[shard]
+            if process.returncode != 0 or not finished(manifestPath,shard):
+                failed.append(shard)
+            print('Shard ' + str(shard) + (' failed' if shard in failed else ' done'))
+        time.sleep(0.1)
+    return sorted(failed)
+
+def merge(manifestPath,fileFormat='csv',compression=None,trace=None):
+    # the shard Reports merged into '<output> Report' in descending p Value order
+    # and the shard Tables into '<output> Table'; returns the Report path and the Table
+    trace = Instrument.Trace() if trace is None else trace
+    manifest = readJSON(manifestPath)
+    directory = os.path.dirname(manifestPath)
+    shards = manifest['shards']
+    missing = [str(entry['shard']) for entry in shards if not finished(manifestPath,entry['shard'])]
+    if len(missing) > 0:
+        raise ValueError('Shards not finished: ' + ', '.join(missing))
+    outputName = manifest['output']
+    mediators = pandas.Series(numpy.arange(len(manifest['mediators'])),index=manifest['mediators'])
+    #ties keep the single scan's mediator-major, sheet-row order: by mediator, then
+    #shard (shards are consecutive), then the row's place in its shard's Report
+    span = max([entry['snps'] for entry in shards]) * max(1,len(mediators)) + 1
+    dtypes = {name:(str if dtype == object else dtype) for name, dtype in SNPEngine.reportColumns.items()}
+    sink = SNPEngine.reportSink(outputName,fileFormat,compression)
+    tables = []
+    try:
+        with trace.stage('merge'):
+            for entry in shards:
+                name = shardName(directory,entry['shard'])
+                position = 0
+                for chunk in pandas.read_csv(name + ' Report.csv',dtype=dtypes,keep_default_na=False,
+                                             float_precision='round_trip',chunksize=2**18):
+                    order = (mediators[chunk['Mediator']].to_numpy()*len(shards) + entry['shard'])*span + \
+                            position + numpy.arange(len(chunk))
+                    sink.append({column:chunk[column].to_numpy(dtype=dtype) for column, dtype in SNPEngine.reportColumns.items()},
+                                order=order)
+                    position += len(chunk)
+                if entry['snps'] > 0 and os.path.exists(name + ' Table.csv'):
+                    tables.append(pandas.read_csv(name + ' Table.csv',dtype={'SNP Name':str},keep_default_na=False))
+        trace.count('shards merged',len(shards))
+        with trace.stage('write',cancellable=False):
+            significanceCount = pandas.concat(tables,ignore_index=True) if len(tables) > 0 else \
+                                pandas.DataFrame({'SNP Name':[],'Number Significant Mediators':[]})
+            significanceCount = SNPEngine.writeResults(significanceCount,outputName)
+            trace.count('report rows written',sink.close())
+            trace.count('table rows written',len(significanceCount))
+    except BaseException:
+        sink.discard()
+        raise
+    return sink.path, significanceCount
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--cache-dir',default=SNPCache.defaultCacheDir,help='where parsed workbooks are cached')
+    common.add_argument('--no-cache',action='store_true',help='always re-parse the workbook')
+    common.add_argument('--trace',default=None,metavar='FILE',help='write stage times, memory and counters to FILE (.json, or .csv)')
+    testing = argparse.ArgumentParser(add_help=False)
+    testing.add_argument('-j','--workers',type=int,default=1,help='test SNP chunks on this many processes per shard')
+    testing.add_argument('--no-checkpoint',action='store_true',help='do not keep finished chunks for resuming an interrupted shard')
+    testing.add_argument('--chunk-rows',type=int,default=15000,metavar='ROWS',
+                         help='shards stream a CSV or .xlsx sheet in chunks of ROWS rows, keeping only their own SNPs; '
+                              '0 parses the whole sheet in every shard')
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('--format',default='csv',choices=['csv','parquet'],help='file format of the merged Report')
+    output.add_argument('--compression',default=None,help='merged Report compression, as for SNPEngine.py scan')
+    parser = argparse.ArgumentParser(description='Scan a SNP/cytokine workbook in shards.')
+    stages = parser.add_subparsers(dest='stage',required=True)
+    planParser = stages.add_parser('plan',parents=[common],help='screen the SNPs and split them into shards')
+    runParser = stages.add_parser('run',parents=[common,testing,output],help='plan, run every shard locally and merge')
+    for stageParser in (planParser,runParser):
+        stageParser.add_argument('path')
+        stageParser.add_argument('-s','--sheet',default='Sheet1')
+        stageParser.add_argument('-c','--cell',default='A1')
+        stageParser.add_argument('-o','--output',required=True,help='output name; the shards are kept in "<output> Shards"')
+        stageParser.add_argument('-n','--shards',type=int,default=4)
+        stageParser.add_argument('--stream',type=int,default=None,metavar='ROWS',
+                                 help='plan from the sheet streamed in chunks of ROWS rows, keeping only the SNPs passing the screen')
+    runParser.add_argument('-p','--processes',type=int,default=None,help='shards run at once (default: all)')
+    shardParser = stages.add_parser('shard',parents=[common,testing],help='test one shard of a plan')
+    shardParser.add_argument('manifest')
+    shardParser.add_argument('shard',type=int)
+    mergeParser = stages.add_parser('merge',parents=[common,output],help='combine the finished shards')
+    mergeParser.add_argument('manifest')
+    args = parser.parse_args(argv)
+    cache = None if args.no_cache else SNPCache.DataCache(args.cache_dir)
+    trace = Instrument.Trace()
+    try:
+        if args.stage in ('plan','run'):
+            manifestPath = plan(args.path,args.sheet,args.cell,args.output,args.shards,cache,args.stream,trace)
+        if args.stage == 'run':
+            options = ['--cache-dir',args.cache_dir,'-j',str(args.workers),'--chunk-rows',str(args.chunk_rows)]
+            options += ['--no-cache'] if args.no_cache else []
+            options += ['--no-checkpoint'] if args.no_checkpoint else []
+            with trace.stage('shards'):
+                failed = runLocal(manifestPath,args.processes,options)
+            if len(failed) > 0:
+                print('Error: shards ' + ', '.join(str(k) for k in failed) + ' failed; see their logs in ' +
+                      os.path.dirname(manifestPath))
+                return 1
+        if args.stage == 'shard':
+            runShard(args.manifest,args.shard,cache,args.chunk_rows or None,args.workers,not args.no_checkpoint,trace)
+        if args.stage == 'merge':
+            merge(args.manifest,args.format,args.compression,trace)
+        if args.stage == 'run':
+            merge(manifestPath,args.format,args.compression,trace)
+    except ValueError as e:
+        print('Error: ' + str(e))
+        return 1
+    print(trace.report())
+    if args.trace is not None:
+        trace.write(args.trace)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+'''
+SourceLoader
+
+Reads several CSV or .xlsx sources at once on a thread pool. Each Source
+names the columns and rows its stage needs: only those columns are
+parsed, with the C engine and every cell kept as its string, and rows
+are filtered chunk by chunk as they are read, so a large sheet costs
+one pass and little memory. A source can use the frames of others it
+depends on, e.g. to keep only the sheet rows whose Name is in a table read
+beside it; it waits for them only when it first uses them, so a large sheet
+starts parsing while the small table is still being read. With a SNPCache
+the projected frame is cached, keyed on its columns and row values; the
+parse still starts at once, and a cached frame replaces what it parsed
+while the row values were being read.
+'''
+
+import json
+import hashlib
+import itertools
+import concurrent.futures
+import pandas
+
+import SNPReader
+
+class Loaded(object):
+    # the frames of a source's needs by name; each is waited for when first used
+    def __init__(self,futures):
+        self.futures = futures
+
+    def __contains__(self,name):
+        return name in self.futures
+
+    def __getitem__(self,name):
+        return self.futures[name].result()
+
+    def ready(self):
+        return all(future.done() for future in self.futures.values())
+
+class Source(object):
+    # columns: list, or function(header, loaded) -> list; None keeps every column.
+    # rows: {column: values}, values a list or function(loaded) -> list; a row is
+    # kept when any of its columns holds one of the values; None keeps every row.
+    # needs: names of sources whose frames loaded holds; columns are resolved before the
+    # parse starts and row values once their sources are read, so a slow source overlaps the parse.
+    # nrows=0 reads only the header.
+    def __init__(self,path,columns=None,rows=None,needs=(),nrows=None,sheet='Sheet1',cell='A1',chunksize=15000,**options):
+        self.path = path
+        self.columns = columns
+        self.rows = rows
+        self.needs = list(needs)
+        self.nrows = nrows
+        self.sheet = sheet
+        self.cell = cell
+        self.chunksize = chunksize
+        self.options = options
+
+    def header(self):
+        if self.path.endswith('.xlsx'):
+            return list(next(SNPReader.iterExcel(self.path,self.sheet,self.cell,chunksize=1)).columns)
+        return list(pandas.read_csv(self.path,nrows=0,**self.options).columns)
+
+    def chunks(self,columns):
+        if self.path.endswith('.xlsx'):
+            return (chunk[columns] for chunk in SNPReader.iterExcel(self.path,self.sheet,self.cell,self.chunksize))
+        return SNPReader.iterCSV(self.path,self.chunksize,usecols=columns,nrows=self.nrows,**self.options)
+
+    def read(self,loaded,cache=None):
+        # the projected frame; its index is the sheet row of each kept row
+        header = self.header()
+        columns = header if self.columns is None else self.columns
+        columns = columns(header,loaded) if callable(columns) else list(columns)
+        missing = [str(c) for c in list(columns) + list(self.rows or {}) if c not in header]
+        if len(missing) > 0:
+            raise ValueError('Columns not found in ' + self.path + ': ' + ', '.join(missing[:10]) + (' ...' if len(missing) > 10 else ''))
+        if self.nrows == 0:
+            return pandas.DataFrame(columns=columns,dtype=object)
+        chunks = self.chunks(list(columns) + [c for c in (self.rows or {}) if c not in columns])
+        #parse while the sources the row values come from are still being read; their chunks are filtered once the values are in
+        early = []
+        while self.rows is not None and not loaded.ready():
+            chunk = next(chunks,None)
+            if chunk is None:
+                break
+            early.append(chunk)
+        rows = self.rowValues(loaded)
+        build = lambda: self.project(itertools.chain(early,chunks),columns,rows)
+        if cache is None:
+            return build()
+        #the cache key needs the row values: a cached frame replaces the chunks parsed so far
+        projection = json.dumps([list(columns),{column:sorted(values) for column, values in rows.items()}])
+        options = {'reader':'source','sheet':self.sheet,'cell':self.cell,'nrows':self.nrows,'chunksize':self.chunksize,
+                   'options':self.options,'projection':hashlib.blake2b(projection.encode(),digest_size=16).hexdigest()}
+        frame = cache.load(self.path,options,lambda: build().rename_axis('sheet row').reset_index())
+        chunks.close()
+        return frame.set_index('sheet row').rename_axis(None)
+
+    def rowValues(self,loaded):
+        # {column: set of values} of the row filter
+        if self.rows is None:
+            return {}
+        return {column:set(values(loaded) if callable(values) else values) for column, values in self.rows.items()}
+
+    def project(self,chunks,columns,rows):
+        frames = []
+        for chunk in chunks:
+            if self.rows is not None:
+                mask = pandas.Series(False,index=chunk.index)
+                for column, values in rows.items():
+                    mask |= chunk[column].isin(values)
+                chunk = chunk[mask]
+            frames.append(chunk[columns])
+        if len(frames) == 0:
+            return pandas.DataFrame(columns=columns,dtype=object)
+        return pandas.concat(frames)
+
+def loadSources(sources,workers=None,cache=None):
+    # sources: {name: Source}, each listed after the sources it needs; cache: SNPCache.DataCache
+    # for the projected frames, None to parse every time; returns {name: frame} once all are read
+    names = list(sources)
+    for i in range(len(names)):
+        for need in sources[names[i]].needs:
+            if need not in names[:i]:
+                raise ValueError('Source ' + names[i] + ' needs ' + need + ', which must be listed before it')
+    futures = {}
+    def read(name):
+        return sources[name].read(Loaded({need:futures[need] for need in sources[name].needs}),cache)
+    #sources are submitted in order, so the ones waited on always start first
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or len(names)) as pool:
+        for name in names:
+            futures[name] = pool.submit(read,name)
+    return {name:futures[name].result() for name in names}
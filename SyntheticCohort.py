@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+'''
+SyntheticCohort
+
+Random workbooks in the layout SNP Scanner reads: twelve metadata columns
+(patient_id, Name, Chr, Position, Normalization, ...) then one column per
+patient; discharge and MOD rows, 'time' rows each followed by the
+plasma_2_* mediators (with '<'/'>' qualified and missing values), AA/AB/BB
+SNP rows and the Normalization rows that close the SNP block. Some SNPs
+copy their neighbour's genotypes (linkage disequilibrium) and a few follow
+one mediator's levels, so scans have something to find. CSV output is
+written a block of SNP rows at a time.
+
+Run "python SyntheticCohort.py <patients> <SNPs> <mediators> -o cohort.csv".
+'''
+
+import sys
+import argparse
+import numpy
+import pandas
+
+metaCols = ['patient_id','Name','Chr','Position','Normalization'] + ['meta' + str(i) for i in range(7)]
+timeLabels = ['h0','h6','12h','24hr','48h','72h','h96','7d']
+outcomeRows = ['discharge_total_icu_days','discharge_total_hospital_days','discharge_total_ventilator_days'] + \
+              ['MOD' + str(i) for i in range(1,8)]
+genotypeLabels = numpy.array(['AA','AB','BB',None],dtype=object)#code -1 picks None
+
+def sheetRows(patients,values,**meta):
+    # metadata columns first, patient columns after; meta values are one per row
+    frame = pandas.DataFrame(values,columns=patients)
+    for col in reversed(metaCols):
+        frame.insert(0,col,meta.get(col,None))
+    return frame
+
+def mediatorValues(rng,nMediators,nTimes,nPatients,missingRate=0.1,qualifiedRate=0.1):
+    # (mediators, times, patients) floats, and the same as sheet text with qualifiers
+    numbers = numpy.round(rng.gamma(2.,10.,(nMediators,nTimes,nPatients)),1)
+    text = numbers.astype(str).astype(object)
+    u = rng.random(numbers.shape)
+    low = (u >= missingRate) & (u < missingRate + qualifiedRate/2)
+    high = (u >= missingRate + qualifiedRate/2) & (u < missingRate + qualifiedRate)
+    text[low] = '<' + text[low]
+    text[high] = '>' + text[high]
+    text[u < missingRate] = None
+    numbers[u < missingRate] = numpy.nan
+    return numbers, text
+
+def genotypeBlock(rng,nSNPs,nPatients,missingRate=0.05):
+    # int8 codes 0/1/2 (AA/AB/BB), -1 missing; about 30% of SNPs have a rare B allele
+    common = rng.random(nSNPs) < 0.7
+    cumulative = numpy.where(common[:,None],[0.34,0.66],[0.74,0.95])
+    u = rng.random((nSNPs,nPatients))
+    codes = (u > cumulative[:,0:1]).astype(numpy.int8) + (u > cumulative[:,1:2])
+    codes[rng.random((nSNPs,nPatients)) < missingRate] = -1
+    return codes
+
+def followMediator(rng,levels,missingRate=0.05):
+    # genotype codes tracking one mediator's per-patient mean: high -> AA, low -> BB
+    order = numpy.argsort(numpy.argsort(-levels))
+    quantile = order / max(1,len(levels) - 1)
+    codes = numpy.where(quantile < 0.35,0,numpy.where(quantile < 0.65,1,2)).astype(numpy.int8)
+    codes[rng.random(len(levels)) < missingRate] = -1
+    return codes
+
+def cohortBlocks(nPatients,nSNPs,nMediators,seed=0,nTimes=5,deathRate=0.1,ldFraction=0.2,nAssociated=None,blockSize=20000):
+    # DataFrames in sheet order: clinical and mediator rows, SNP blocks, Normalization rows
+    rng = numpy.random.default_rng(seed)
+    patients = ['HR-' + str(i) for i in range(nPatients)]
+    nTimes = min(nTimes,len(timeLabels))
+    yield sheetRows(patients,[numpy.where(rng.random(nPatients) < deathRate,'Death','Home').astype(object)],
+                    patient_id=['discharge_discharged_to'])
+    yield sheetRows(patients,rng.integers(0,30,(len(outcomeRows),nPatients)).astype(str).astype(object),patient_id=outcomeRows)
+    numbers, text = mediatorValues(rng,nMediators,nTimes,nPatients)
+    names = ['plasma_2_c' + str(c) for c in range(nMediators)]
+    for t in range(nTimes):
+        labels = numpy.where(rng.random(nPatients) < 0.9,timeLabels[t],None).astype(object)
+        yield sheetRows(patients,numpy.vstack([labels[None,:],text[:,t,:]]),patient_id=['time'] + names)
+    nAssociated = max(1,nSNPs // 200) if nAssociated is None else nAssociated
+    associated = {}
+    if nMediators > 0:
+        for snp in rng.choice(nSNPs,min(nSNPs,nAssociated),replace=False):
+            associated[int(snp)] = int(rng.integers(nMediators))
+    observed = ~numpy.isnan(numbers)
+    levels = numpy.where(observed,numbers,0).sum(axis=1) / numpy.maximum(observed.sum(axis=1),1)
+    previous = None
+    for start in range(0,nSNPs,blockSize):
+        stop = min(nSNPs,start + blockSize)
+        codes = genotypeBlock(rng,stop - start,nPatients)
+        for snp, c in associated.items():
+            if start <= snp < stop:
+                codes[snp - start] = followMediator(rng,levels[c])
+        #LD: copy the previous SNP's genotypes
+        for i in numpy.flatnonzero(rng.random(stop - start) < ldFraction):
+            if i > 0:
+                codes[i] = codes[i-1]
+            elif previous is not None:
+                codes[i] = previous
+        previous = codes[-1].copy()
+        snps = numpy.arange(start,stop)
+        yield sheetRows(patients,genotypeLabels[codes],Name=['rs' + str(i) for i in snps],
+                        Chr=[str(1 + i % 22) for i in snps],Position=list(1000*snps))
+    yield sheetRows(patients,numpy.full((3,nPatients),None,dtype=object),Normalization=['norm' + str(i) for i in range(3)])
+
+def makeCohort(nPatients,nSNPs,nMediators,seed=0,**options):
+    return pandas.concat(list(cohortBlocks(nPatients,nSNPs,nMediators,seed,**options)),ignore_index=True)
+
+def writeCohort(path,nPatients,nSNPs,nMediators,seed=0,**options):
+    if path.endswith('.xlsx'):
+        makeCohort(nPatients,nSNPs,nMediators,seed,**options).to_excel(path,sheet_name='Sheet1',index=False)
+        return path
+    header = True
+    with open(path,'w',newline='') as f:
+        for block in cohortBlocks(nPatients,nSNPs,nMediators,seed,**options):
+            block.to_csv(f,index=False,header=header)
+            header = False
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a random cohort workbook in the SNP Scanner layout.')
+    parser.add_argument('patients',type=int)
+    parser.add_argument('snps',type=int)
+    parser.add_argument('mediators',type=int)
+    parser.add_argument('-o','--output',default='cohort.csv',help='.csv or .xlsx (sheet "Sheet1")')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--times',type=int,default=5,help='time points per patient (at most ' + str(len(timeLabels)) + ')')
+    parser.add_argument('--ld',type=float,default=0.2,help='fraction of SNPs copying the previous SNP')
+    args = parser.parse_args(argv)
+    writeCohort(args.output,args.patients,args.snps,args.mediators,args.seed,nTimes=args.times,ldFraction=args.ld)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+'''
+BatchMWU checks against scipy.stats.mannwhitneyu(x, y, alternative='two-sided'):
+tied scores, the exact distribution scipy falls back to for small tie-free
+groups, empty groups and missing observations.
+Run "python -m pytest" or "python -m unittest" from the repository.
+'''
+
+import unittest
+import numpy
+from scipy import stats
+
+import BatchMWU
+
+def partitions(rng,nPatients,nParts,sizeA,sizeB):
+    # disjoint A and B patient masks, sizeA and sizeB patients each
+    maskA = numpy.zeros((nParts,nPatients),dtype=bool)
+    maskB = numpy.zeros((nParts,nPatients),dtype=bool)
+    for i in range(nParts):
+        order = rng.permutation(nPatients)
+        maskA[i,order[:sizeA]] = True
+        maskB[i,order[sizeA:sizeA+sizeB]] = True
+    return maskA, maskB
+
+class MannWhitneyTest(unittest.TestCase):
+    def assertMatchesScipy(self,values,owners,maskA,maskB):
+        U, p, nA, nB = BatchMWU.mannWhitneyBatch(values,owners,maskA,maskB)
+        present = ~numpy.isnan(values)
+        for i in range(maskA.shape[0]):
+            x = values[maskA[i,owners] & present]
+            y = values[maskB[i,owners] & present]
+            self.assertEqual((nA[i],nB[i]),(len(x),len(y)))
+            expected = stats.mannwhitneyu(x,y,alternative='two-sided')
+            self.assertAlmostEqual(U[i],expected[0],places=9)
+            self.assertAlmostEqual(p[i],expected[1],places=12)
+
+    def testTies(self):
+        #scores 0-4, one to three observations per patient
+        rng = numpy.random.default_rng(1)
+        owners = numpy.repeat(numpy.arange(40),rng.integers(1,4,40))
+        values = rng.integers(0,5,len(owners)).astype(float)
+        self.assertMatchesScipy(values,owners,*partitions(rng,40,30,15,18))
+
+    def testExactFallback(self):
+        #tie-free groups of at most 8 use scipy's exact distribution
+        rng = numpy.random.default_rng(2)
+        owners = numpy.arange(30)
+        values = rng.normal(size=30)
+        for sizeA, sizeB in [(3,5),(8,20),(20,6)]:
+            self.assertMatchesScipy(values,owners,*partitions(rng,30,10,sizeA,sizeB))
+
+    def testLargeGroupsWithoutTies(self):
+        rng = numpy.random.default_rng(3)
+        owners = numpy.arange(60)
+        values = rng.normal(size=60)
+        self.assertMatchesScipy(values,owners,*partitions(rng,60,10,25,30))
+
+    def testMissingObservations(self):
+        #NaN observations are left out, as if they were never taken
+        rng = numpy.random.default_rng(4)
+        owners = numpy.repeat(numpy.arange(40),2)
+        values = rng.integers(0,10,80).astype(float)
+        values[rng.random(80) < 0.2] = numpy.nan
+        self.assertMatchesScipy(values,owners,*partitions(rng,40,20,12,15))
+
+    def testEmptyGroup(self):
+        rng = numpy.random.default_rng(5)
+        owners = numpy.arange(20)
+        values = rng.normal(size=20)
+        maskA, maskB = partitions(rng,20,3,10,10)
+        maskB[1,:] = False
+        #patients 0-4 have only missing observations, so a group of them is empty too
+        values[:5] = numpy.nan
+        maskA[2,:] = False
+        maskA[2,:5] = True
+        U, p, nA, nB = BatchMWU.mannWhitneyBatch(values,owners,maskA,maskB)
+        self.assertEqual((nB[1],nA[2]),(0,0))
+        self.assertTrue(numpy.isnan(U[1:]).all() and numpy.isnan(p[1:]).all())
+        self.assertFalse(numpy.isnan(p[0]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+'''
+SNPIndex checks: the index and GenotypeStore must agree on SNP names, so
+every row the index finds can be looked up in a store built from it.
+Run "python -m pytest" or "python -m unittest" from the repository.
+'''
+
+import unittest
+import pandas
+
+import SNPIndex
+from GenotypeStore import GenotypeStore
+
+class PaddedNameTest(unittest.TestCase):
+    def setUp(self):
+        #' rs2' and 'rs3 ' carry padding as typed into the sheet
+        self.data = pandas.DataFrame({'patient_id':[None,None,None],
+                                      'Name':['rs1',' rs2','rs3 '],
+                                      'Chr':['chr1','chr1','2'],
+                                      'Position':['10','20','5'],
+                                      'p1':['AA','BB','AB'],
+                                      'p2':['AB','AA','BB']})
+        self.index = SNPIndex.SNPIndex(SNPIndex.indexFrame([self.data]))
+
+    def testPaddedNameFoundInIndexAndStore(self):
+        names = [' rs2','rs3 ']
+        rows = self.index.rows(names)
+        self.assertEqual(rows,[1,2])
+        store = GenotypeStore.fromFrame(self.data,rows,['p1','p2'])
+        self.assertEqual([store.snpIndex[name] for name in names],[0,1])
+        self.assertEqual(list(store.row(' rs2')),list(store.calls[0,:]))
+
+    def testStrippedNameNotFound(self):
+        #the sheet's name is ' rs2', so 'rs2' is missing in the index as in the store
+        with self.assertRaises(ValueError):
+            self.index.rows(['rs2'])
+        store = GenotypeStore.fromFrame(self.data,self.index.rows(['rs1',' rs2']),['p1','p2'])
+        self.assertNotIn('rs2',store.snpIndex)
+
+    def testRegionNamesAreStoreKeys(self):
+        names = self.index.regionNames('chr1')
+        self.assertEqual(names,['rs1',' rs2'])
+        store = GenotypeStore.fromFrame(self.data,self.index.rows(names),['p1','p2'])
+        self.assertEqual(store.snpNames,names)
+
+if __name__ == '__main__':
+    unittest.main()